@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Time how long the settings manager takes to build its UI and get its window on screen
+#
+#   python DevOp/bench_manager.py [runs]
+#
+# Needs a display. Only builds widgets, nothing is saved and no themes are applied
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import gi  # noqa: E402
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib  # noqa: E402
+
+from automathemely.autoth_tools import envspecific, settsmanager, switcher  # noqa: E402
+from automathemely.autoth_tools.utils import get_resource  # noqa: E402
+
+
+def build(files):
+    builder = Gtk.Builder()
+    for file in files:
+        builder.add_from_file(get_resource(file))
+    return builder
+
+
+def time_builds(runs):
+    main_file = ['manager_gui.glade']
+    deskenv_files = ['manager_gui_{}.glade'.format(d) for d in envspecific.SUPPORTED_DESKENVS]
+
+    for label, files in (('everything (as before)', main_file + deskenv_files),
+                         ('main window only', main_file),
+                         ('main window + 1 DE', main_file + deskenv_files[:1])):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            build(files)
+            timings.append(time.perf_counter() - start)
+        print('Builder, {:<24}{:>8.1f} ms'.format(label, min(timings) * 1000))
+
+
+# From the start of the app to the first frame of its window
+def time_first_paint(user_settings):
+    app = settsmanager.App(user_settings)
+    start = time.perf_counter()
+    result = dict()
+
+    def on_draw(*args):
+        if 'paint' not in result:
+            result['paint'] = time.perf_counter() - start
+            GLib.idle_add(app.quit)
+        return False
+
+    def on_activate(*args):
+        app.main_window.connect_after('draw', on_draw)
+
+    app.connect_after('activate', on_activate)
+    app.run([])
+    return result.get('paint')
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    if not Gtk.init_check()[0]:
+        print('No display available')
+        sys.exit(1)
+
+    time_builds(runs)
+
+    user_settings = switcher.load_user_settings()[0]
+    paint = time_first_paint(user_settings)
+    print('Manager, {:<24}{:>8.1f} ms'.format('first paint', paint * 1000 if paint else float('nan')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Validate the vectorized solar engine against astral and compare how long both take
+#
+#   python DevOp/bench_solarcalc.py [sites] [days]
+import sys
+import time
+from datetime import date, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+from astral import Observer
+from astral.sun import dawn, dusk, sunrise, sunset
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from automathemely.autoth_tools import solarcalc  # noqa: E402
+
+# Anything over this (in seconds) counts as a mismatch
+TOLERANCE = 60
+ASTRAL_EVENTS = {'sunrise': sunrise, 'sunset': sunset, 'dawn': dawn, 'dusk': dusk}
+
+
+def main():
+    n_sites = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 366
+
+    rng = np.random.default_rng(0)
+    # Keep away from the poles, astral and the engine agree there too but there is little to compare
+    latitudes = rng.uniform(-65, 65, n_sites)
+    longitudes = rng.uniform(-180, 180, n_sites)
+    first_day = date.today()
+    dates = [first_day + timedelta(days=i) for i in range(n_days)]
+
+    start = time.perf_counter()
+    results = solarcalc.sun_times(dates, latitudes, longitudes)
+    vectorized = time.perf_counter() - start
+    print('solarcalc: {} sites x {} days in {:.3f}s'.format(n_sites, n_days, vectorized))
+
+    # astral is way slower, so only check a sample of the sites
+    sample = range(min(n_sites, 20))
+    worst, compared, missing = 0.0, 0, 0
+    start = time.perf_counter()
+    for i in sample:
+        observer = Observer(latitudes[i], longitudes[i])
+        for j, day in enumerate(dates):
+            for event, astral_func in ASTRAL_EVENTS.items():
+                try:
+                    expected = astral_func(observer, date=day, tzinfo=timezone.utc).timestamp()
+                except ValueError:
+                    expected = None
+                got = results[event][i, j]
+                if expected is None or np.isnan(got):
+                    missing += (expected is None) != np.isnan(got)
+                    continue
+                worst = max(worst, abs(expected - got))
+                compared += 1
+    astral_time = time.perf_counter() - start
+
+    print('astral: {} sites x {} days in {:.3f}s ({:.1f}x slower per site)'.format(
+        len(sample), n_days, astral_time, (astral_time / len(sample)) / (vectorized / n_sites)))
+    print('compared {} events, worst difference {:.1f}s, {} missing on only one side'.format(compared, worst, missing))
+
+    if worst > TOLERANCE or missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Cold start budget for the automathemely CLI
+#
+#   python DevOp/bench_startup.py [--runs N] [--budget MS] [--apply]
+#
+# Every command is started RUNS times as a fresh interpreter, the median wall time is compared against the budget and
+# the slowest imports (from python -X importtime) are listed, so it's easy to spot what blew it. --light and --dark are
+# only measured with --apply since they actually switch the desktop's theme. Exits with 1 if anything is over budget.
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+DEFAULT_BUDGET = 100
+DEFAULT_RUNS = 10
+
+
+def get_commands(apply):
+    settings_file = Path.home().joinpath('.config', 'automathemely', 'user_settings.json')
+    with settings_file.open() as f:
+        notifications = json.load(f)['misc']['notifications']
+
+    commands = [
+        ['--list'],
+        # Sets the value it already has, so nothing changes
+        ['--setting', 'misc.notifications={}'.format(str(notifications).lower())]
+    ]
+    if apply:
+        commands += [['-L'], ['-D']]
+    return commands
+
+
+def run(args, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-m', 'automathemely.bin.run'] + args
+    start = time.perf_counter()
+    p = subprocess.run(command, cwd=str(REPO), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    return (time.perf_counter() - start) * 1000, p.stderr
+
+
+def slowest_imports(importtime_output, count=5):
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        imports.append((int(self_us) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='in milliseconds')
+    parser.add_argument('--apply', action='store_true', help='also measure -L and -D')
+    args = parser.parse_args()
+
+    # What a bare interpreter costs on this machine, for reference
+    baseline = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'])
+        baseline.append((time.perf_counter() - start) * 1000)
+    print('{:<40} median {:6.1f} ms'.format('(bare interpreter)', statistics.median(baseline)))
+
+    over_budget = False
+    for command in get_commands(args.apply):
+        # Warm up the page cache first, we care about interpreter work, not the disk
+        run(command)
+        times = [run(command)[0] for _ in range(args.runs)]
+        median = statistics.median(times)
+
+        status = 'OK' if median <= args.budget else 'OVER BUDGET'
+        over_budget |= median > args.budget
+        print('{:<40} median {:6.1f} ms  max {:6.1f} ms  {}'.format(' '.join(command), median, max(times), status))
+        for self_ms, name in slowest_imports(run(command, importtime=True)[1]):
+            print('    {:6.1f} ms  {}'.format(self_ms, name))
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
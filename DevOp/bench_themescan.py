@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Compare the old serial os.walk scanner with the parallel scandir one (and the theme index) on a synthetic tree
+#
+#   python DevOp/bench_themescan.py [themes] [workers]
+#
+# Run it on a tree in a network mount, or drop the page cache first (as root, echo 3 > /proc/sys/vm/drop_caches),
+# to see the difference on cold stats, a warm local tree mostly shows the overhead of the thread pool
+import os
+import sys
+import tempfile
+import time
+from os import walk
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from automathemely.autoth_tools import envspecific, themeindex  # noqa: E402
+
+N_ROOTS = 3
+
+
+def make_tree(base, n_themes):
+    roots = [os.path.join(base, 'themes{}'.format(i)) for i in range(N_ROOTS)]
+    for i in range(n_themes):
+        theme = os.path.join(roots[i % N_ROOTS], 'Theme-{}'.format(i % (n_themes // 2 or 1)))
+        # Every other theme is a GTK3 one, half of the names are repeated across roots
+        if i % 2:
+            os.makedirs(os.path.join(theme, 'gtk-3.0'), exist_ok=True)
+            Path(theme, 'gtk-3.0', 'gtk.css').touch()
+        else:
+            os.makedirs(theme, exist_ok=True)
+            Path(theme, 'index.theme').touch()
+    return roots
+
+
+# The way walk_filter_dirs used to do it
+def serial_walk_filter_dirs(dirs, filtering_func):
+    filtered_dirs = list()
+    for directory in dirs:
+        scan = next(walk(directory), None)
+        if scan:
+            for subdir in scan[1]:
+                if filtering_func(scan[0], subdir):
+                    filtered_dirs.append(subdir)
+    return filtered_dirs
+
+
+def has_gtk3(parent, t):
+    return any(Path(parent, t).glob('gtk-3.*/gtk.css'))
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = envspecific.sort_remove_dupes(func())
+    print('{:<28}{:>9.1f} ms  ({} themes)'.format(label, (time.perf_counter() - start) * 1000, len(result)))
+    return result
+
+
+def main():
+    n_themes = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    if len(sys.argv) > 2:
+        themeindex.SCAN_WORKERS = int(sys.argv[2])
+
+    with tempfile.TemporaryDirectory() as base:
+        roots = make_tree(base, n_themes)
+        print('{} theme dirs in {} roots, {} workers'.format(n_themes, N_ROOTS, themeindex.SCAN_WORKERS))
+
+        serial = timed('serial os.walk', lambda: serial_walk_filter_dirs(roots, has_gtk3))
+        parallel = timed('parallel scandir', lambda: envspecific.walk_filter_dirs(roots, has_gtk3))
+
+        index = themeindex.ThemeIndex(os.path.join(base, 'theme_index.json'))
+
+        def from_index():
+            return [t for themes in index.get_many(roots, 'general') for t, facts in themes.items() if facts['gtk3']]
+
+        cold = timed('index, cold', from_index)
+        index.save()
+        index = themeindex.ThemeIndex(index.path)
+        warm = timed('index, warm (from disk)', from_index)
+
+        if not serial == parallel == cold == warm:
+            print('MISMATCH between scanners')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
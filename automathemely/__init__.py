@@ -1,27 +1,32 @@
 import logging
-from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from sys import stdout, stderr
-from automathemely.autoth_tools.utils import get_local, notify
+from automathemely.autoth_tools.logqueue import QueuedHandler
+from automathemely.autoth_tools.utils import get_local
 
 _ROOT = str(Path(__file__).resolve().parent)
 __version__ = "1.3.0-dev1"
 
 
-# Move/rename older local config directory name to the new lowercase one
-if Path.home().joinpath('.config', 'AutomaThemely').is_dir():
-    import shutil
-    shutil.move(str(Path.home().joinpath('.config', 'AutomaThemely')), get_local())
+# Create user config dir if it doesn't exist already, a single stat in the usual case
+if not Path(get_local()).is_dir():
+    # Move/rename older local config directory name to the new lowercase one
+    if Path.home().joinpath('.config', 'AutomaThemely').is_dir():
+        import shutil
+        shutil.move(str(Path.home().joinpath('.config', 'AutomaThemely')), get_local())
+    Path(get_local()).mkdir(parents=True, exist_ok=True)
 
-# Create user config dir if it doesn't exist already
-Path(get_local()).mkdir(parents=True, exist_ok=True)
 
-
-# Custom Handler to pass logs as notifications
-class NotifyHandler(logging.StreamHandler):
+# Custom Handler to pass logs as notifications, bursts of them are merged into one and repeated ones rate limited
+class NotifyHandler(logging.Handler):
     def emit(self, record):
-        message = self.format(record)
-        notify(message)
+        from automathemely.autoth_tools.notifier import get_notifier
+        get_notifier().post(self.format(record))
+
+    # Called at exit, don't lose what's still waiting for the coalescing window
+    def flush(self):
+        from automathemely.autoth_tools.notifier import get_notifier
+        get_notifier().flush()
 
 
 # noinspection SpellCheckingInspection
@@ -30,25 +35,21 @@ default_simple_format = '%(levelname)s: %(message)s'
 timed_details_format = '(%(asctime)s) (%(filename)s:%(funcName)s:%(lineno)s) %(levelname)s: %(message)s'
 
 # Setup logging levels/handlers
-main_file_handler = logging.FileHandler(get_local('automathemely.log'), mode='w')
-updsun_file_handler = logging.FileHandler(get_local('.updsuntimes.log'), mode='w')
-# scheduler_file_handler = logging.FileHandler(get_local('.autothscheduler.log'), mode='w')
-# new: rotate at 1 MB with 7 backups (adjust maxBytes/backupCount to taste)
-scheduler_file_handler = RotatingFileHandler(
-    get_local('.autothscheduler.log'),
-    maxBytes=1 * 1024 * 1024,    # 1 MB
-    backupCount=7,               # keep last 7 rotations
-    encoding='utf-8'
-)
-info_or_lower_handler = logging.StreamHandler(stdout)
+# All of them only queue records up, writing them (and waiting on the notification daemon) is left to a background
+# thread, see logqueue. Levels, filters and formatters are set on these and work just like with plain handlers
+# Files are only opened (and truncated) once something is actually logged to them, so merely importing the package
+# (e.g. from the tray, or for a quick --list) doesn't touch them
+main_file_handler = QueuedHandler(logging.FileHandler(get_local('automathemely.log'), mode='w', delay=True))
+updsun_file_handler = QueuedHandler(logging.FileHandler(get_local('.updsuntimes.log'), mode='w', delay=True))
+info_or_lower_handler = QueuedHandler(logging.StreamHandler(stdout))
 info_or_lower_handler.setLevel(logging.DEBUG)
 info_or_lower_handler.addFilter(lambda log: log.levelno <= logging.INFO)
-warning_or_higher_handler = logging.StreamHandler(stderr)
+warning_or_higher_handler = QueuedHandler(logging.StreamHandler(stderr))
 warning_or_higher_handler.setLevel(logging.WARNING)
 # This will be added in run.py if notifications are enabled
 # TODO: Figure out a better way to handle notifications that is as flexible as this that doesn't spam the user in case
 # one of the imported libraries malfunctions and decides to also use this root logger
-notifier_handler = NotifyHandler()
+notifier_handler = QueuedHandler(NotifyHandler())
 notifier_handler.setLevel(logging.INFO)
 
 # Setup root logger
@@ -66,3 +67,21 @@ logging.basicConfig(
     # format='%(levelname)s (%(name)s - %(funcname)s): %(message)s'
     format=default_simple_format
 )
+
+
+# Only the scheduler needs this one, and logging.handlers is not worth importing for everyone else
+def __getattr__(name):
+    global scheduler_file_handler
+    if name == 'scheduler_file_handler':
+        from logging.handlers import RotatingFileHandler
+        # scheduler_file_handler = logging.FileHandler(get_local('.autothscheduler.log'), mode='w')
+        # new: rotate at 1 MB with 7 backups (adjust maxBytes/backupCount to taste)
+        scheduler_file_handler = QueuedHandler(RotatingFileHandler(
+            get_local('.autothscheduler.log'),
+            maxBytes=1 * 1024 * 1024,    # 1 MB
+            backupCount=7,               # keep last 7 rotations
+            encoding='utf-8',
+            delay=True
+        ))
+        return scheduler_file_handler
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import threading
+
+from automathemely.autoth_tools.utils import get_local, atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+#   Record of what was last applied to targets whose current value is expensive to read back (e.g. the GNOME Shell
+#   theme needs gtweak and D-Bus), so applying the same thing again can be skipped. Targets backed by files also keep
+#   their mtime and size, so any change made to them from elsewhere makes it count as not applied anymore
+class AppliedState:
+    def __init__(self, path=None):
+        self.path = path or get_local('last_applied.json')
+        self.lock = threading.Lock()
+        self.dirty = False
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+            if not isinstance(self.entries, dict):
+                self.entries = dict()
+        except (OSError, ValueError):
+            self.entries = dict()
+
+    @staticmethod
+    def _stamps(files):
+        stamps = []
+        for file in files:
+            try:
+                st = os.stat(file)
+            except OSError:
+                stamps.append(None)
+            else:
+                stamps.append([st.st_mtime_ns, st.st_size])
+        return stamps
+
+    def is_applied(self, target, value, files=()):
+        with self.lock:
+            entry = self.entries.get(target)
+        return bool(entry) and entry['value'] == value and entry['stamps'] == self._stamps(files)
+
+    def record(self, target, value, files=()):
+        with self.lock:
+            self.entries[target] = {'value': value, 'stamps': self._stamps(files)}
+            self.dirty = True
+
+    def forget(self, target):
+        with self.lock:
+            if self.entries.pop(target, None) is not None:
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.entries)
+            self.dirty = False
+
+        try:
+            atomic_write(self.path, data)
+        except OSError as e:
+            logger.warning('Could not save the last applied state ({})'.format(e))
+
+
+_state = None
+
+
+def get_state():
+    global _state
+    if _state is None:
+        _state = AppliedState()
+    return _state
@@ -3,9 +3,10 @@ import argparse
 import sys
 import json
 import logging
-import pickle as pkl
 
-from automathemely.autoth_tools.utils import get_local, read_dict, write_dic
+from automathemely.autoth_tools.logqueue import pipeline
+from automathemely.autoth_tools.profiling import PROFILE_KINDS
+from automathemely.autoth_tools.utils import get_local, get_resource, read_dict, write_dic
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +23,11 @@ options.add_argument('-r', '--restart',
                      action='store_true', default=False)
 options.add_argument('-L', '--light', help='apply light theme', action='store_true', default=False)
 options.add_argument('-D', '--dark', help='apply dark theme', action='store_true', default=False)
+# Goes along with switching (automatically, or with --light/--dark) so it isn't one of the options above
+parser.add_argument('--timings', help='print how long each part of the switch took', action='store_true',
+                    default=False)
+parser.add_argument('--profile', help='profile the command and save a report to the profiles dir (default: cpu)',
+                    nargs='?', const='cpu', choices=PROFILE_KINDS)
 
 #   For --list arg
 def print_list(d, indent=0):
@@ -34,13 +40,51 @@ def print_list(d, indent=0):
             print(' = {}'.format(value))
 
 
+#   Which of the options above was given, or 'auto' for none (automatic switching)
+def get_command(args):
+    for option in ('list', 'setting', 'manage', 'update', 'restart', 'light', 'dark'):
+        if getattr(args, option):
+            return option
+    return 'auto'
+
+
+#   Hand manual and automatic switching over to a running scheduler, returns False if there is none to take it
+def send_to_scheduler(args):
+    # The switch has to happen here to be timed or profiled
+    if args.timings or args.profile:
+        return False
+    elif args.light:
+        mode = 'light'
+    elif args.dark:
+        mode = 'dark'
+    elif not any(vars(args).values()):
+        mode = 'auto'
+    else:
+        return False
+
+    from automathemely.autoth_tools import ctlsocket
+    response = ctlsocket.send_command('apply', mode=mode)
+    if not response:
+        return False
+
+    if not response['ok']:
+        logger.error('The scheduler could not switch themes ({})'.format(response['error']))
+    elif not response['mode']:
+        logger.error('The scheduler could not determine which themes to switch to')
+    else:
+        logger.info('Switched to {} themes through the scheduler'.format(response['mode']))
+    return True
+
+
 #   ARGUMENTS FUNCTION
-def main(us_se):
-    args = parser.parse_args()
+def main(us_se, args=None):
+    if args is None:
+        args = parser.parse_args()
 
     #   LIST
     if args.list:
         logger.info('Printing current settings...')
+        pipeline.drain()
         print('')
         print_list(us_se)
         return
@@ -79,7 +123,14 @@ def main(us_se):
         else:
             key_list = [to_set_key]
 
-        if read_dict(us_se, key_list) is not None:
+        # Settings added since the file was last merged with the defaults (which only happens on version changes) can
+        # be set too
+        key_exists = read_dict(us_se, key_list) is not None
+        if not key_exists:
+            with open(get_resource('default_user_settings.json'), 'r') as f:
+                key_exists = read_dict(json.load(f), key_list) is not None
+
+        if key_exists:
             write_dic(us_se, key_list, to_set_val)
 
             with open(get_local('user_settings.json'), 'w') as file:
@@ -103,12 +154,28 @@ def main(us_se):
         settsmanager.main(us_se)
         return
 
+    #   UPDATE
+    elif args.update:
+        from automathemely.autoth_tools import suntable
+        if suntable.update(us_se):
+            logger.info('Successfully updated the sunrise and sunset\'s times')
+        else:
+            logger.error('There were some errors while updating the sunrise and sunset\'s times')
+        return
+
     #   RESTART
     elif args.restart:
-        from automathemely.autoth_tools.utils import pgrep, get_bin, get_local
+        from automathemely.autoth_tools import ctlsocket
+        from automathemely.autoth_tools.utils import pgrep, get_bin
         import os, time
         from subprocess import Popen, STDOUT
 
+        # A healthy scheduler only needs to pick up the current settings, no need to start it all over again
+        response = ctlsocket.send_command('reload', timeout=2)
+        if response and response['ok']:
+            logger.info('The scheduler is already running, reloaded its settings')
+            return
+
         # kill any running scheduler
         if pgrep(['autothscheduler.py'], use_full=True):
             Popen(['pkill', '-f', 'autothscheduler.py']).wait()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+
+from automathemely.autoth_tools.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+#   Edit a text config file in a single pass: it's read once, edit gets its contents (as a list of lines, keeping their
+#   line endings) and returns the new ones. The file is only written if they actually changed, and then atomically, so
+#   apps watching it aren't woken up for nothing and it's never left half written. Returns whether it was written
+def patch_lines(path, edit):
+    return patch_text(path, lambda text: ''.join(edit(text.splitlines(keepends=True))))
+
+
+#   Same as patch_lines, but edit gets and returns the whole text
+def patch_text(path, edit):
+    path = str(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    new_text = edit(text)
+    if new_text == text:
+        logger.debug('{} is already up to date'.format(path))
+        return False
+
+    atomic_write(path, new_text)
+    return True
+
+
+class JSONCError(ValueError):
+    pass
+
+
+#   Walk the top level object of a JSONC (JSON with comments and trailing commas) document, like VSCode's settings.json.
+#   Yields (key, value_start, value_end) for each of its members, and (None, end, end) last, where end is the position
+#   of the closing brace. Nested values are skipped without being parsed
+def _jsonc_members(text):
+    length = len(text)
+
+    def skip_blank(i):
+        while i < length:
+            if text[i] in ' \t\r\n\ufeff':
+                i += 1
+            elif text.startswith('//', i):
+                i = text.find('\n', i)
+                if i < 0:
+                    return length
+            elif text.startswith('/*', i):
+                i = text.find('*/', i + 2)
+                if i < 0:
+                    raise JSONCError('Unterminated comment')
+                i += 2
+            else:
+                break
+        return i
+
+    def skip_string(i):
+        i += 1
+        while i < length:
+            if text[i] == '\\':
+                i += 2
+            elif text[i] == '"':
+                return i + 1
+            else:
+                i += 1
+        raise JSONCError('Unterminated string')
+
+    #   Until the end of the value starting at i, that is the next comma or closing bracket at the same depth
+    def skip_value(i):
+        depth = 0
+        end = i
+        while i < length:
+            char = text[i]
+            if char == '"':
+                i = skip_string(i)
+                end = i
+                continue
+            elif text.startswith('//', i) or text.startswith('/*', i):
+                i = skip_blank(i)
+                continue
+            elif char in '[{':
+                depth += 1
+            elif char in ']}':
+                if depth == 0:
+                    return end
+                depth -= 1
+            elif char == ',' and depth == 0:
+                return end
+            if char not in ' \t\r\n':
+                end = i + 1
+            i += 1
+        raise JSONCError('Unexpected end of document')
+
+    pos = skip_blank(0)
+    if not text.startswith('{', pos):
+        raise JSONCError('Not a JSON object')
+    pos += 1
+
+    while True:
+        pos = skip_blank(pos)
+        if text.startswith('}', pos):
+            yield None, pos, pos
+            return
+        if not text.startswith('"', pos):
+            raise JSONCError('Expected a key at {}'.format(pos))
+
+        key_end = skip_string(pos)
+        key = json.loads(text[pos:key_end])
+        pos = skip_blank(key_end)
+        if not text.startswith(':', pos):
+            raise JSONCError('Expected ":" at {}'.format(pos))
+
+        value_start = skip_blank(pos + 1)
+        value_end = skip_value(value_start)
+        yield key, value_start, value_end
+
+        pos = skip_blank(value_end)
+        if text.startswith(',', pos):
+            pos += 1
+
+
+#   Set a key of the top level object of a JSONC document by only touching the bytes of its value (or inserting it
+#   before the closing brace if it isn't there), so comments, trailing commas and formatting everywhere else are kept
+def set_jsonc_key(text, key, value):
+    new_value = json.dumps(value)
+    if not text.strip():
+        return '{{\n    {}: {}\n}}\n'.format(json.dumps(key), new_value)
+
+    first_start = None
+    last_end = None
+    for member_key, start, end in _jsonc_members(text):
+        if member_key == key:
+            return text[:start] + new_value + text[end:]
+        if member_key is None:
+            closing_brace = start
+        else:
+            if first_start is None:
+                first_start = start
+            last_end = end
+
+    # Indent it like the first member, or with 4 spaces if the object is empty
+    indent = '    '
+    if first_start is not None:
+        line_start = text.rfind('\n', 0, first_start) + 1
+        line = text[line_start:first_start]
+        indent = line[:len(line) - len(line.lstrip(' \t'))]
+
+    member = '{}: {}'.format(json.dumps(key), new_value)
+    if last_end is None:
+        return text[:closing_brace].rstrip() + '\n' + indent + member + '\n' + text[closing_brace:]
+
+    # Right after the last member, or after its trailing comma if it has one, so it keeps having one
+    trailing_comma = text.find(',', last_end, closing_brace)
+    if trailing_comma >= 0 and not text[last_end:trailing_comma].strip():
+        return text[:trailing_comma + 1] + '\n' + indent + member + ',' + text[trailing_comma + 1:]
+    return text[:last_end] + ',\n' + indent + member + text[last_end:]
+
+
+#   Set a key in a JSONC file with set_jsonc_key, creating the file if it doesn't exist yet
+def patch_jsonc_key(path, key, value):
+    path = str(path)
+    if not os.path.isfile(path):
+        atomic_write(path, set_jsonc_key('', key, value))
+        return True
+    return patch_text(path, lambda text: set_jsonc_key(text, key, value))
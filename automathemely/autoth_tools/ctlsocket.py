@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import socket
+import socketserver
+from threading import Thread
+
+from automathemely.autoth_tools.utils import get_local
+
+logger = logging.getLogger(__name__)
+
+# Protocol: the client sends a single JSON object on one line, e.g. {"command": "apply", "mode": "dark"}, and the
+# scheduler answers with another one, always containing "ok" and, if that is false, an "error" message
+COMMANDS = ('apply', 'reload', 'status', 'shutdown')
+# Applying can take a moment (e.g. lookandfeeltool), everything else should be instant
+DEFAULT_TIMEOUT = 30
+
+
+def get_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'automathemely.sock')
+    return get_local('.control.sock')
+
+
+#   CLIENT
+#   Returns the scheduler's response, or None if it is not running
+def send_command(command, timeout=DEFAULT_TIMEOUT, **params):
+    request = dict(params, command=command)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(get_socket_path())
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as f:
+                response = f.readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        return
+    except OSError as e:
+        logger.warning('Could not talk to the scheduler ({})'.format(e))
+        return
+
+    try:
+        return json.loads(response.decode('utf-8'))
+    except ValueError:
+        return
+
+
+#   SERVER
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            command = request.pop('command')
+        except (ValueError, KeyError, AttributeError):
+            response = {'ok': False, 'error': 'Invalid request'}
+        else:
+            handler = self.server.handlers.get(command)
+            if not handler:
+                response = {'ok': False, 'error': 'Unknown command "{}"'.format(command)}
+            else:
+                # noinspection PyBroadException
+                try:
+                    response = dict(handler(**request) or dict(), ok=True)
+                except Exception as e:
+                    logger.exception('Error while handling "{}"'.format(command), exc_info=e)
+                    response = {'ok': False, 'error': str(e)}
+
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+    # handlers maps each command to a callable taking the request's parameters as keyword arguments, and returning a
+    # dict to be added to the response
+    def __init__(self, handlers):
+        self.path = get_socket_path()
+        self.server = None
+        self.handlers = handlers
+
+    def start(self):
+        if os.path.exists(self.path):
+            # Left behind by a scheduler that didn't exit cleanly, unless it's actually still alive
+            if send_command('status', timeout=2):
+                raise RuntimeError('Another scheduler is already listening on {}'.format(self.path))
+            os.unlink(self.path)
+
+        old_umask = os.umask(0o177)
+        try:
+            self.server = _Server(self.path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+        self.server.handlers = self.handlers
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
@@ -1,9 +1,10 @@
-from os import walk
 from collections import defaultdict
 from pathlib import Path
 
 import logging
 
+from automathemely.autoth_tools.timings import span
+
 logger = logging.getLogger(__name__)
 
 # GTK, Cinnamon's desktop and GNOME shell themes all share the same dirs, but have different structures and conditions
@@ -42,6 +43,31 @@ MISC_NAMES = {
 }
 
 
+# Settings objects are kept around so long running processes (i.e. the scheduler) don't have to look up the schemas
+# again on every switch. They are all in delay-apply mode, so nothing is written until flush_gsettings()
+_gsettings_cache = dict()
+
+
+def get_gsettings(schema):
+    from gi.repository import Gio
+    if schema not in _gsettings_cache:
+        settings = Gio.Settings.new(schema)
+        settings.delay()
+        _gsettings_cache[schema] = settings
+    return _gsettings_cache[schema]
+
+
+# Commit every pending change of each schema as a single write, and without a main loop nothing guarantees they reach
+# dconf, so make sure they do before moving on
+def flush_gsettings():
+    if _gsettings_cache:
+        from gi.repository import Gio
+        for settings in _gsettings_cache.values():
+            if settings.get_has_unapplied():
+                settings.apply()
+        Gio.Settings.sync()
+
+
 def correct_name_case(name):
     if name in UPPERCASE_NAMES:
         return name.upper()
@@ -68,16 +94,17 @@ def sort_remove_dupes(lis):
 
 
 def walk_filter_dirs(dirs, filtering_func, return_parent=False):
+    from automathemely.autoth_tools.themeindex import scan_roots
+
     filtered_dirs = list()
-    for directory in dirs:
-        scan = next(walk(directory), None)
-        if scan:
-            for subdir in scan[1]:
-                if filtering_func(scan[0], subdir):
-                    if return_parent:
-                        filtered_dirs.append((subdir, scan[0]))
-                    else:
-                        filtered_dirs.append(subdir)
+    # Results come back in the same order as dirs, so callers can still rely on their hierarchy
+    for directory, scan in zip(dirs, scan_roots(dirs, filtering_func)):
+        for subdir, matches in scan:
+            if matches:
+                if return_parent:
+                    filtered_dirs.append((subdir, directory))
+                else:
+                    filtered_dirs.append(subdir)
 
     return filtered_dirs
 
@@ -104,251 +131,369 @@ def get_installed_themes(desk_env):
     elif desk_env not in SUPPORTED_DESKENVS:
         raise Exception('Invalid Desktop Environment "{}"'.format(desk_env))
 
-    # Actually start scanning for themes
+    # Actually start scanning for themes, all of what we need to know about them is kept in the theme index
+    from automathemely.autoth_tools.themeindex import get_index
+    index = get_index()
+
+    def filter_index(dirs, kind, filtering_func):
+        return [(t, facts) for themes in index.get_many(dirs, kind) for t, facts in themes.items()
+                if filtering_func(t, facts)]
+
     if types['gtk']:
-        t_list = walk_filter_dirs(PATH_CONSTANTS['general-themes'] + PATH_CONSTANTS['special-paths']['gtk'],
-                                  lambda parent, t: Path(parent).joinpath(t).glob('gtk-3.*/gtk.css')
-                                  and t.lower() != 'default')
-        themes['gtk'] = [(t,) for t in sort_remove_dupes(t_list)]
+        t_list = filter_index(PATH_CONSTANTS['general-themes'] + PATH_CONSTANTS['special-paths']['gtk'], 'general',
+                              lambda t, facts: facts['gtk3'] and t.lower() != 'default')
+        themes['gtk'] = [(t,) for t in sort_remove_dupes([t for t, _ in t_list])]
 
     if types['icons']:
-        t_list = walk_filter_dirs(PATH_CONSTANTS['icons-themes'], lambda parent, t: Path(parent)
-                                  .joinpath(t, 'index.theme').is_file() and t.lower() != 'default')
-        themes['icons'] = [(t,) for t in sort_remove_dupes(t_list)]
+        t_list = filter_index(PATH_CONSTANTS['icons-themes'], 'icons',
+                              lambda t, facts: facts['icons'] and t.lower() != 'default')
+        themes['icons'] = [(t,) for t in sort_remove_dupes([t for t, _ in t_list])]
 
     if types['desktop']:
         # I guess a hidden default?
         t_list = ['cinnamon']
-        t_list += walk_filter_dirs(PATH_CONSTANTS['general-themes'], lambda parent, t: Path(parent)
-                                   .joinpath(t, 'cinnamon').is_dir())
+        t_list += [t for t, _ in filter_index(PATH_CONSTANTS['general-themes'], 'general',
+                                              lambda t, facts: facts['cinnamon'])]
         themes['desktop'] = [(t,) for t in sort_remove_dupes(t_list)]
 
     if types['lookandfeel']:
-        import configparser
-        import json
-        t_list = walk_filter_dirs(PATH_CONSTANTS['lookandfeel-themes'], lambda parent, t: Path(parent)
-                                  .joinpath(t, 'metadata.desktop').is_file() or Path(parent)
-                                  .joinpath(t, 'metadata.json').is_file(), return_parent=True)
-        t_list = sort_remove_dupes(t_list)
-
-        for t in t_list:
-            parent_dir = t[1]
-            theme = t[0]
-            # Prioritize .desktop metadata files to .json ones just like systemsettings
-            if Path(parent_dir).joinpath(theme, 'metadata.desktop').is_file():
-                # if os.path.isfile('{}{}/metadata.desktop'.format(t[1], t[0])):
-                metadata = configparser.ConfigParser(strict=False)
-                metadata.read(str(Path(parent_dir).joinpath(theme, 'metadata.desktop')))
-                t_name = metadata['Desktop Entry']['Name']
-
-            # Has to be JSON because it was already filtered before
-            else:
-                with Path(parent_dir).joinpath(theme, 'metadata.json').open() as f:
-                    metadata = json.load(f)
-                t_name = metadata['KPlugin']['Name']
-
-            themes['lookandfeel'].append((t[0], t_name))
+        t_list = filter_index(PATH_CONSTANTS['lookandfeel-themes'], 'lookandfeel',
+                              lambda t, facts: facts['lookandfeel'])
+        themes['lookandfeel'] = sort_remove_dupes([(t, facts['lookandfeel']) for t, facts in t_list])
 
     if types['shell']:
         # This is explained in the function below
         t_list = ['default']
-        t_list += walk_filter_dirs(PATH_CONSTANTS['general-themes'], lambda parent, t: Path(parent)
-                                   .joinpath(t, 'gnome-shell', 'gnome-shell.css').is_file() and t.lower() != 'default')
+        t_list += [t for t, _ in filter_index(PATH_CONSTANTS['general-themes'], 'general',
+                                              lambda t, facts: facts['shell'] and t.lower() != 'default')]
 
         themes['shell'] = [(t,) for t in sort_remove_dupes(t_list)]
 
+    index.save()
     return themes
 
 
-def set_theme(desk_env, t_type, theme):
-    if desk_env not in SUPPORTED_DESKENVS:
-        raise Exception('Invalid desktop environment!')
+def _write_kde_gtk_theme(theme):
+    from subprocess import run
+    import configparser
+    import io
+    from automathemely.autoth_tools.confpatch import patch_text, patch_lines
+    from automathemely.autoth_tools.utils import get_bin
+
+    # Set GTK3 theme
+    # This would usually be done with kwriteconfig but since there is no way to notify GTK3 apps that the
+    # theme has changed in KDE like with GTK2 anyway we might as well do it this way
+    def edit_gtk3(text):
+        parser = configparser.ConfigParser(strict=False)
+        # Prevent changing the key's case
+        parser.optionxform = lambda option: option
+        parser.read_string(text)
+
+        parser['Settings']['gtk-theme-name'] = theme
+        output = io.StringIO()
+        parser.write(output, space_around_delimiters=False)
+        return output.getvalue()
+
+    try:
+        patch_text(PATH_CONSTANTS['kde-gtk-config']['gtk3'], edit_gtk3)
+    except (OSError, KeyError, configparser.Error):
+        logger.error('Could not write the GTK3 config file, set a theme from System Settings at least once and try '
+                     'again')
+
+    # Search for gtk2 config file in theme dir in PATH_CONSTANTS dirs
+    # As if it wasn't messy enough already...
+    match = walk_filter_dirs(PATH_CONSTANTS['general-themes'], lambda parent_dir, t: Path(parent_dir)
+                             .joinpath(t).glob('gtk-2.*/gtkrc') and t.lower() != 'default', return_parent=True)
+
+    if not match:
+        logger.warning('The selected GTK theme does not contain a GTK2 theme, so some applications may '
+                       'look odd')
+    else:
+        # If there are several themes with the same name in different directories, only get the first one
+        # to match according to the dirs hierarchy in PATH_CONSTANTS
+        theme_parent = match[0][1]
 
-    elif not theme:
-        logger.error('{}\'s {} theme not set '.format(correct_name_case(desk_env), correct_name_case(t_type)))
-        return
+        if not Path(PATH_CONSTANTS['kde-gtk-config']['gtk2']).is_file():
+            logger.warning('GTK2 config file not found, set a theme from System Settings at least once and '
+                           'try again')
 
-    if t_type in ['gtk', 'icons']:
-        from gi.repository import Gio
-        if desk_env == 'cinnamon':
-            gsettings_string = 'org.cinnamon.desktop.interface'
+        # Write GTK2 config
         else:
-            gsettings_string = 'org.gnome.desktop.interface'
+            line_replaced = False
+
+            def edit_gtk2(lines):
+                nonlocal line_replaced
+                new_lines = []
+                previous_is_autogen_comment = False
+                for line in lines:
+                    if line.startswith('# Configs for GTK2 programs'):
+                        previous_is_autogen_comment = True
+                        new_lines.append(line)
+
+                    # Even in kde-config-gtk they don't seem to agree if this may not actually be needed, but
+                    # just in case here it is
+                    elif line.startswith('include'):
+                        new_lines.append('include "{}"\n'.format(str(Path(theme_parent).joinpath(theme, 'gtk-2.0',
+                                                                                                  'gtkrc'))))
+
+                    # This is the one that matters
+                    elif line.startswith('gtk-theme-name='):
+                        new_lines.append('gtk-theme-name="{}"\n'.format(theme))
+                        line_replaced = True
 
-        gsettings = Gio.Settings.new(gsettings_string)
+                    else:
+                        if previous_is_autogen_comment:
+                            if not line.startswith('# Edited by AutomaThemely'):
+                                new_lines.append('# Edited by AutomaThemely\n')
+                            previous_is_autogen_comment = False
+                        new_lines.append(line)
+                return new_lines
+
+            changed = patch_lines(PATH_CONSTANTS['kde-gtk-config']['gtk2'], edit_gtk2)
+
+            if not line_replaced:
+                logger.warning('GTK2 config file is invalid, set a theme from System Settings at least '
+                               'once and try again')
+            elif changed:
+                # Send signal to GTK2 apps to refresh their themes
+                run([get_bin('kde-refresh-gtk2')])
+
+
+def _write_shell_theme(theme):
+    # This is WAY out of my level, I'll just let the professionals handle this one...
+    try:
+        import gtweak
+    except ImportError:
+        logger.error('GNOME Tweaks not installed')
+        return
 
-    # Safety fallback, shouldn't happen
+    from gtweak.gshellwrapper import GnomeShellFactory
+    from gtweak.defs import GSETTINGS_SCHEMA_DIR, LOCALE_DIR
+    # This could probably be implemented in house but since we're already importing from gtweak I guess it'll stay
+    # this way for now
+    from gtweak.gsettings import GSettingsSetting
+
+    gtweak.GSETTINGS_SCHEMA_DIR = GSETTINGS_SCHEMA_DIR
+    gtweak.LOCALE_DIR = LOCALE_DIR
+    shell = GnomeShellFactory().get_shell()
+    shell_theme_name = 'user-theme@gnome-shell-extensions.gcampax.github.com'
+    shell_theme_schema = 'org.gnome.shell.extensions.user-theme'
+    shell_theme_schema_dir = Path(PATH_CONSTANTS['shell-user-extensions']).joinpath(shell_theme_name, 'schemas')
+
+    if not shell:
+        logger.error('GNOME Shell not running')
+        return
     else:
-        gsettings = None
+        # noinspection PyBroadException
+        try:
+            shell_extensions = shell.list_extensions()
+        except Exception:
+            logger.error('GNOME Shell extensions could not be loaded')
+            return
+        else:
+            # noinspection PyBroadException
+            try:
+                if shell_theme_name in shell_extensions and shell_extensions[shell_theme_name]['state'] == 1:
+                    # If shell user-theme was installed locally e. g. through extensions.gnome.org
+                    if Path(shell_theme_schema_dir).is_dir():
+                        user_shell_settings = GSettingsSetting(shell_theme_schema,
+                                                               schema_dir=str(shell_theme_schema_dir))
+                    # If it was installed as a system extension
+                    else:
+                        user_shell_settings = GSettingsSetting(shell_theme_schema)
+                else:
+                    logger.error('GNOME Shell user theme extension not enabled')
+                    return
+            except Exception:
+                logger.error('Could not load GNOME Shell user theme extension')
+                return
+            else:
+                # To set the default theme you have to input an empty string, but since that won't work with the
+                # Setting Manager's ComboBoxes we set it by this placeholder name
+                if theme == 'default':
+                    theme = ''
 
-    if t_type == 'gtk':
+                # Set the GNOME Shell theme
+                user_shell_settings.set_string('name', theme)
+                return True
 
-        # Easy peasy
-        # For GNOME and Cinnamon
-        gsettings['gtk-theme'] = theme
 
-        # For XFCE
-        if desk_env == 'xfce':
-            from subprocess import run, CalledProcessError
-            try:
-                # noinspection SpellCheckingInspection
-                run(['xfconf-query', '-c', 'xsettings', '-p', '/Net/ThemeName', '-s', theme])
-            except CalledProcessError:
-                logger.error('Could not apply GTK theme')
-                return
+# Both GTK config files are only rewritten (and GTK2 apps only told to reload) if they changed since they were last
+# written with this theme
+def _set_kde_gtk_theme(theme):
+    from automathemely.autoth_tools.appliedstate import get_state
 
-        # Switching GTK themes in KDE is a little bit more complicated than the others...
-        # For KDE
-        elif desk_env == 'kde':
-            from subprocess import run
-            import configparser
-            import fileinput
-            import sys
-            from automathemely.autoth_tools.utils import get_bin
-
-            # Set GTK3 theme
-            # This would usually be done with kwriteconfig but since there is no way to notify GTK3 apps that the
-            # theme has changed in KDE like with GTK2 anyway we might as well do it this way
-            parser = configparser.ConfigParser(strict=False)
-            # Prevent changing the key's case
-            parser.optionxform = lambda option: option
-            parser.read(PATH_CONSTANTS['kde-gtk-config']['gtk3'])
-
-            parser['Settings']['gtk-theme-name'] = theme
-            with open(PATH_CONSTANTS['kde-gtk-config']['gtk3'], 'w') as f:
-                parser.write(f, space_around_delimiters=False)
-
-            # Search for gtk2 config file in theme dir in PATH_CONSTANTS dirs
-            # As if it wasn't messy enough already...
-            match = walk_filter_dirs(PATH_CONSTANTS['general-themes'], lambda parent_dir, t: Path(parent_dir)
-                                     .joinpath(t).glob('gtk-2.*/gtkrc') and t.lower() != 'default', return_parent=True)
-
-            if not match:
-                logger.warning('The selected GTK theme does not contain a GTK2 theme, so some applications may '
-                               'look odd')
-            else:
-                # If there are several themes with the same name in different directories, only get the first one
-                # to match according to the dirs hierarchy in PATH_CONSTANTS
-                theme_parent = match[0][1]
+    state = get_state()
+    config_files = list(PATH_CONSTANTS['kde-gtk-config'].values())
+    if state.is_applied('kde-gtk', theme, config_files):
+        logger.debug('KDE\'s GTK theme is already {}'.format(theme))
+        return
 
-                if not Path(PATH_CONSTANTS['kde-gtk-config']['gtk2']).is_file():
-                    logger.warning('GTK2 config file not found, set a theme from System Settings at least once and '
-                                   'try again')
+    _write_kde_gtk_theme(theme)
+    state.record('kde-gtk', theme, config_files)
 
-                # Write GTK2 config
-                else:
-                    line_replaced, previous_is_autogen_comment = False, False
-                    for line in fileinput.input(PATH_CONSTANTS['kde-gtk-config']['gtk2'], inplace=True):
-
-                        if line.startswith('# Configs for GTK2 programs'):
-                            previous_is_autogen_comment = True
-                            sys.stdout.write(line)
-
-                        # Even in kde-config-gtk they don't seem to agree if this may not actually be needed, but
-                        # just in case here it is
-                        elif line.startswith('include'):
-                            print('include "{}"'.format(str(Path(theme_parent).joinpath(theme, 'gtk-2.0', 'gtkrc'))))
-
-                        # This is the one that matters
-                        elif line.startswith('gtk-theme-name='):
-                            print('gtk-theme-name="{}"'.format(theme))
-                            line_replaced = True
-
-                        else:
-                            if previous_is_autogen_comment and not line.startswith('# Edited by AutomaThemely'):
-                                print('# Edited by AutomaThemely')
-                                previous_is_autogen_comment = False
-                            sys.stdout.write(line)
-
-                    if not line_replaced:
-                        logger.warning('GTK2 config file is invalid, set a theme from System Settings at least '
-                                       'once and try again')
-                    else:
-                        # Send signal to GTK2 apps to refresh their themes
-                        run([get_bin('kde-refresh-gtk2')])
 
-    elif t_type == 'icons':
+# Reading the current one back would be about as expensive as setting it, so rely on what was last set instead
+def _set_shell_theme(theme):
+    from automathemely.autoth_tools.appliedstate import get_state
+
+    state = get_state()
+    if state.is_applied('shell', theme):
+        logger.debug('GNOME Shell theme is already {}'.format(theme))
+        return
+
+    if _write_shell_theme(theme):
+        state.record('shell', theme)
+    else:
+        state.forget('shell')
+
+
+def get_current_lookandfeel():
+    import configparser
+    kdeglobals = configparser.ConfigParser(strict=False, interpolation=None)
+    try:
+        kdeglobals.read(str(HOME.joinpath('.config', 'kdeglobals')))
+        return kdeglobals['KDE']['LookAndFeelPackage']
+    except (configparser.Error, KeyError, UnicodeDecodeError):
+        return
+
 
-        # For GNOME and Cinnamon
-        gsettings['icon-theme'] = theme
+def _set_lookandfeel_theme(theme):
+    from subprocess import run, CalledProcessError
 
-        # For XFCE
-        if desk_env == 'xfce':
-            from subprocess import run, CalledProcessError
+    if get_current_lookandfeel() == theme:
+        logger.debug('Look and Feel theme is already {}'.format(theme))
+        return
+
+    try:
+        # noinspection SpellCheckingInspection
+        run(['lookandfeeltool', '-a', '{}'.format(theme)], check=True)
+    except CalledProcessError:
+        logger.error('Could not apply Look and Feel theme')
+
+
+#   Set several xfconf properties at once, straight through xfconfd's D-Bus interface instead of forking
+#   xfconf-query for each one
+def _set_xfconf(channel, properties):
+    from gi.repository import Gio, GLib
+    try:
+        bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+        for prop, value in properties.items():
             try:
-                # noinspection SpellCheckingInspection
-                run(['xfconf-query', '-c', 'xsettings', '-p', '/Net/IconThemeName', '-s', theme])
-            except CalledProcessError:
-                logger.error('Could not apply icons theme')
-                return
+                current = bus.call_sync('org.xfce.Xfconf', '/org/xfce/Xfconf', 'org.xfce.Xfconf', 'GetProperty',
+                                        GLib.Variant('(ss)', (channel, prop)), GLib.VariantType('(v)'),
+                                        Gio.DBusCallFlags.NONE, -1, None).unpack()[0]
+            except GLib.Error:
+                # Not set at all yet
+                current = None
+            if current == value:
+                continue
+
+            bus.call_sync('org.xfce.Xfconf', '/org/xfce/Xfconf', 'org.xfce.Xfconf', 'SetProperty',
+                          GLib.Variant('(ssv)', (channel, prop, GLib.Variant('s', value))), None,
+                          Gio.DBusCallFlags.NONE, -1, None)
+        return
+    except GLib.Error as e:
+        logger.debug('Could not reach xfconfd ({}), falling back to xfconf-query'.format(e))
 
-    elif t_type == 'shell':
-        # This is WAY out of my level, I'll just let the professionals handle this one...
-        try:
-            import gtweak
-        except ImportError:
-            logger.error('GNOME Tweaks not installed')
-            return
+    from subprocess import Popen
+    # At least run them all at the same time
+    # noinspection SpellCheckingInspection
+    processes = [Popen(['xfconf-query', '-c', channel, '-p', prop, '-s', value]) for prop, value in properties.items()]
+    for process, prop in zip(processes, properties):
+        if process.wait():
+            logger.error('Could not set {}'.format(prop))
 
-        from gtweak.gshellwrapper import GnomeShellFactory
-        from gtweak.defs import GSETTINGS_SCHEMA_DIR, LOCALE_DIR
-        # This could probably be implemented in house but since we're already importing from gtweak I guess it'll stay
-        # this way for now
-        from gtweak.gsettings import GSettingsSetting
-
-        gtweak.GSETTINGS_SCHEMA_DIR = GSETTINGS_SCHEMA_DIR
-        gtweak.LOCALE_DIR = LOCALE_DIR
-        shell = GnomeShellFactory().get_shell()
-        shell_theme_name = 'user-theme@gnome-shell-extensions.gcampax.github.com'
-        shell_theme_schema = 'org.gnome.shell.extensions.user-theme'
-        shell_theme_schema_dir = Path(PATH_CONSTANTS['shell-user-extensions']).joinpath(shell_theme_name, 'schemas')
-
-        if not shell:
-            logger.error('GNOME Shell not running')
-            return
-        else:
+
+#   Run one of apply_themes' slow backends, timing it under its name without the _set_ prefix
+def _timed_backend(func, theme):
+    with span('backend', backend=func.__name__.replace('_set_', '', 1)):
+        return func(theme)
+
+
+#   Apply a whole theme set (e.g. user_settings['themes'][desk_env]['dark']) in one go. All GSettings keys are
+#   committed together and xfconf is set in a single batch, while slow backends (Look and Feel, GNOME Shell, KDE's GTK
+#   config) run concurrently, so everything changes at about the same time instead of one repaint per theme type.
+#   Anything already set to the right theme is left alone, so applying the same set again costs next to nothing
+def apply_themes(desk_env, themes):
+    if desk_env not in SUPPORTED_DESKENVS:
+        raise Exception('Invalid desktop environment!')
+
+    if desk_env == 'cinnamon':
+        interface_schema = 'org.cinnamon.desktop.interface'
+    else:
+        interface_schema = 'org.gnome.desktop.interface'
+
+    gsettings_writes = []
+    xfconf_writes = dict()
+    background = []
+    for t_type, theme in themes.items():
+        if not theme:
+            logger.error('{}\'s {} theme not set '.format(correct_name_case(desk_env), correct_name_case(t_type)))
+            continue
+
+        if t_type == 'gtk':
+            # Easy peasy
+            # For GNOME and Cinnamon
+            gsettings_writes.append((interface_schema, 'gtk-theme', theme))
+
+            # For XFCE
+            if desk_env == 'xfce':
+                xfconf_writes['/Net/ThemeName'] = theme
+
+            # Switching GTK themes in KDE is a little bit more complicated than the others...
+            # For KDE
+            elif desk_env == 'kde':
+                background.append((_set_kde_gtk_theme, theme))
+
+        elif t_type == 'icons':
+            # For GNOME and Cinnamon
+            gsettings_writes.append((interface_schema, 'icon-theme', theme))
+
+            # For XFCE
+            if desk_env == 'xfce':
+                xfconf_writes['/Net/IconThemeName'] = theme
+
+        elif t_type == 'shell':
+            background.append((_set_shell_theme, theme))
+
+        elif t_type == 'lookandfeel':
+            background.append((_set_lookandfeel_theme, theme))
+
+        elif t_type == 'desktop':
+            gsettings_writes.append(('org.cinnamon.theme', 'name', theme))
+
+    futures = []
+    executor = None
+    if background:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=len(background))
+        futures = [(func.__name__, executor.submit(_timed_backend, func, theme)) for func, theme in background]
+
+    try:
+        if gsettings_writes:
+            with span('backend', backend='gsettings'):
+                for schema, key, value in gsettings_writes:
+                    gsettings = get_gsettings(schema)
+                    if gsettings[key] != value:
+                        gsettings[key] = value
+                flush_gsettings()
+
+        if xfconf_writes:
+            with span('backend', backend='xfconf'):
+                _set_xfconf('xsettings', xfconf_writes)
+    finally:
+        for name, future in futures:
             # noinspection PyBroadException
             try:
-                shell_extensions = shell.list_extensions()
-            except Exception:
-                logger.error('GNOME Shell extensions could not be loaded')
-                return
-            else:
-                # noinspection PyBroadException
-                try:
-                    if shell_theme_name in shell_extensions and shell_extensions[shell_theme_name]['state'] == 1:
-                        # If shell user-theme was installed locally e. g. through extensions.gnome.org
-                        if Path(shell_theme_schema_dir).is_dir():
-                            user_shell_settings = GSettingsSetting(shell_theme_schema,
-                                                                   schema_dir=str(shell_theme_schema_dir))
-                        # If it was installed as a system extension
-                        else:
-                            user_shell_settings = GSettingsSetting(shell_theme_schema)
-                    else:
-                        logger.error('GNOME Shell user theme extension not enabled')
-                        return
-                except Exception:
-                    logger.error('Could not load GNOME Shell user theme extension')
-                    return
-                else:
-                    # To set the default theme you have to input an empty string, but since that won't work with the
-                    # Setting Manager's ComboBoxes we set it by this placeholder name
-                    if theme == 'default':
-                        theme = ''
+                future.result()
+            except Exception as e:
+                logger.exception('Error in {}'.format(name), exc_info=e)
+        if executor:
+            executor.shutdown()
+            from automathemely.autoth_tools.appliedstate import get_state
+            get_state().save()
 
-                    # Set the GNOME Shell theme
-                    user_shell_settings.set_string('name', theme)
 
-    elif t_type == 'lookandfeel':
-        from subprocess import run, CalledProcessError
-        try:
-            # noinspection SpellCheckingInspection
-            run(['lookandfeeltool', '-a', '{}'.format(theme)], check=True)
-        except CalledProcessError:
-            logger.error('Could not apply Look and Feel theme')
-            return
-
-    elif t_type == 'desktop':
-        from gi.repository import Gio
-        cinnamon_settings = Gio.Settings.new('org.cinnamon.theme')
-        cinnamon_settings['name'] = theme
+def set_theme(desk_env, t_type, theme):
+    apply_themes(desk_env, {t_type: theme})
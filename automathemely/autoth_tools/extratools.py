@@ -4,31 +4,79 @@ import os
 from pathlib import Path
 from subprocess import check_output, CalledProcessError
 
+from automathemely.autoth_tools import timings
+
 import logging
 logger = logging.getLogger(__name__)
 
 
-#   For getting vscode themes
-def scan_vscode_extensions(path):
+# Bump whenever what is cached for each extension changes
+VSCODE_CACHE_VERSION = 1
+
+
+#   Theme ids (or labels) contributed by a single extension, extensions without any are just skipped
+def read_vscode_extension_themes(package_json):
+    try:
+        with open(package_json) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    contributes = data.get('contributes') if isinstance(data, dict) else None
+    if not isinstance(contributes, dict):
+        return []
+
     t_list = []
+    for i in contributes.get('themes') or []:
+        if not isinstance(i, dict):
+            continue
+        elif 'id' in i:
+            t_list.append(i['id'])
+        elif 'label' in i:
+            t_list.append(i['label'])
+    return t_list
+
+
+#   For getting vscode themes
+#   Every package.json is only parsed again when its mtime changes, the rest comes from a cache in the config dir.
+#   Stats and parsing are spread over a thread pool
+def scan_vscode_extensions(paths):
+    from automathemely.autoth_tools.themeindex import scan_roots
+    from automathemely.autoth_tools.utils import get_local, atomic_write
+
+    cache_path = get_local('vscode_themes.json')
     try:
-        for k in next(os.walk(path))[1]:
-            with Path(path).joinpath(k, 'package.json').open() as f:
-                data = json.load(f)
-                if 'themes' in data['contributes']:
-                    for i in data['contributes']['themes']:
-                        if 'id' in i:
-                            t_list.append(i['id'])
-                        elif 'label' in i:
-                            t_list.append(i['label'])
-    except StopIteration:
-        pass
-
-    list.sort(t_list)
-    themes = []
-    for name in t_list:
-        themes.append((name,))
-    return themes
+        with open(cache_path) as f:
+            cache = json.load(f)
+        cache = cache['extensions'] if cache.get('version') == VSCODE_CACHE_VERSION else dict()
+    except (OSError, ValueError, AttributeError, KeyError):
+        cache = dict()
+
+    def probe(parent, extension):
+        extension_dir = os.path.join(parent, extension)
+        package_json = os.path.join(extension_dir, 'package.json')
+        try:
+            mtime = os.stat(package_json).st_mtime_ns
+        except OSError:
+            return
+        cached = cache.get(extension_dir)
+        if cached and cached['mtime'] == mtime:
+            return cached
+        return {'mtime': mtime, 'themes': read_vscode_extension_themes(package_json)}
+
+    new_cache = dict()
+    for path, scan in zip(paths, scan_roots(paths, probe)):
+        for extension, entry in scan:
+            if entry:
+                new_cache[os.path.join(path, extension)] = entry
+
+    if new_cache != cache:
+        try:
+            atomic_write(cache_path, json.dumps({'version': VSCODE_CACHE_VERSION, 'extensions': new_cache}))
+        except OSError as e:
+            logger.warning('Could not save the VSCode themes cache ({})'.format(e))
+
+    return [(name,) for name in sorted({t for entry in new_cache.values() for t in entry['themes']})]
 
 
 # Should be delayed and avoided as much as possible...
@@ -61,9 +109,7 @@ def get_installed_extra_themes(extra):
                                    '/usr/lib/extensions',
                                    '/usr/share/code/resources/app/extensions',
                                    '/opt/visual-studio-code/resources/app/extensions']
-        vscode_themes = []
-        for p in vscode_extensions_paths:
-            vscode_themes += scan_vscode_extensions(p)
+        vscode_themes = scan_vscode_extensions(vscode_extensions_paths)
 
         if not vscode_themes:
             return
@@ -72,9 +118,39 @@ def get_installed_extra_themes(extra):
             return {'themes': vscode_themes}
 
 
+#   Last result of get_installed_extra_themes for each extra, so it can be shown right away while looking again
+def get_cached_extra_themes(extra):
+    from automathemely.autoth_tools.utils import get_local
+    try:
+        with open(get_local('extra_themes.json')) as f:
+            cached = json.load(f)[extra]
+    except (OSError, ValueError, KeyError, TypeError):
+        return
+
+    # JSON has no tuples
+    return {t_type: [tuple(t) for t in themes] for t_type, themes in cached.items()} if cached else None
+
+
+def cache_extra_themes(extra, themes):
+    from automathemely.autoth_tools.utils import get_local, atomic_write
+    try:
+        with open(get_local('extra_themes.json')) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = dict()
+
+    if not isinstance(cache, dict):
+        cache = dict()
+    cache[extra] = themes
+
+    try:
+        atomic_write(get_local('extra_themes.json'), json.dumps(cache))
+    except OSError as e:
+        logger.warning('Could not save the extra themes cache ({})'.format(e))
+
+
 def set_extra_theme(us_se, extra, theme_type):
-    import fileinput
-    import sys
+    from automathemely.autoth_tools.confpatch import patch_lines, patch_jsonc_key, JSONCError
     if extra == 'atom':
 
         target_file = Path.home().joinpath('.atom', 'config.cson')
@@ -82,27 +158,27 @@ def set_extra_theme(us_se, extra, theme_type):
             logger.error('Atom config file not found')
             return
 
-        lines_below_keyword = 0
-        for line in fileinput.input(str(target_file), inplace=True):
-            # First look for line with the keyword "themes", then write lines
-            if line.strip().startswith('themes:'):
-                sys.stdout.write(line)
-                lines_below_keyword += 1
-
-            elif lines_below_keyword == 1:
-                # Make sure it has the same spaces as the original file
-                preceding_spaces = ' ' * (len(line) - len(line.lstrip(' ')))
-                print(preceding_spaces + '"' + us_se['extras']['atom']['themes'][theme_type]['theme'] + '"')
-                lines_below_keyword += 1
-
-            elif lines_below_keyword == 2:
-                # Make sure it has the same spaces as the original file
-                preceding_spaces = ' ' * (len(line) - len(line.lstrip(' ')))
-                print(preceding_spaces + '"' + us_se['extras']['atom']['themes'][theme_type]['syntax'] + '"')
-                lines_below_keyword += 1
+        # Rewriting it makes Atom reload its config, which patch_lines avoids if the themes are already set
+        def edit(lines):
+            lines_below_keyword = 0
+            for i, line in enumerate(lines):
+                # First look for line with the keyword "themes", then replace the two lines below it
+                if lines_below_keyword == 0:
+                    if line.strip().startswith('themes:'):
+                        lines_below_keyword += 1
 
-            else:
-                sys.stdout.write(line)
+                elif lines_below_keyword <= 2:
+                    # Make sure it has the same spaces as the original file
+                    preceding_spaces = ' ' * (len(line) - len(line.lstrip(' ')))
+                    key = 'theme' if lines_below_keyword == 1 else 'syntax'
+                    lines[i] = preceding_spaces + '"' + us_se['extras']['atom']['themes'][theme_type][key] + '"\n'
+                    lines_below_keyword += 1
+
+                else:
+                    break
+            return lines
+
+        patch_lines(target_file, edit)
 
     elif extra == 'vscode':
         target_file = Path.home().joinpath('.config', 'Code', 'User', 'settings.json')
@@ -116,43 +192,111 @@ def set_extra_theme(us_se, extra, theme_type):
             logger.error('VSCode config directory not found')
             return
 
-        # Sometimes the settings file is not present until the user changes a setting
-        if target_file.is_file():
-            with target_file.open() as f:
-                p = json.load(f)
+        # Only the theme's value is replaced, keeping the user's comments and formatting, and nothing is written if
+        # it's already set since, same as with Atom, VSCode reloads its settings whenever the file changes. Sometimes
+        # the settings file is not present until the user changes a setting, then it's created
+        try:
+            patch_jsonc_key(target_file, 'workbench.colorTheme', us_se['extras']['vscode']['themes'][theme_type])
+        except JSONCError as e:
+            logger.error('Could not parse the VSCode settings file ({})'.format(e))
+
+
+# Scripts get killed if they take longer than this (in seconds)
+SCRIPT_TIMEOUT = 120
+# How many scripts can run at the same time
+SCRIPT_WORKERS = 4
+
+# Script failures are only logged, the user gets a single notification about them once they are all done
+scripts_logger = logging.getLogger(__name__ + '.scripts')
+
+
+def _not_from_scripts(record):
+    return not record.name.startswith(scripts_logger.name)
+
+
+def _run_script(n, script, timeout):
+    from subprocess import Popen, PIPE, TimeoutExpired
+    import signal
+    import time
+
+    start = time.monotonic()
+    try:
+        # In its own session, so whatever it started can be killed along with it if it times out
+        process = Popen([os.path.expanduser(script)], stdout=PIPE, stderr=PIPE, start_new_session=True)
+    except OSError as e:
+        scripts_logger.error('Script {} ({}) could not be run ({})'.format(n, script, e))
+        return False
+
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        stdout, stderr = process.communicate()
+        scripts_logger.error('Script {} ({}) timed out after {}s'.format(n, script, timeout))
+        ok = False
+    else:
+        duration = time.monotonic() - start
+        ok = process.returncode == 0
+        if ok:
+            scripts_logger.info('Script {} ({}) finished in {:.2f}s'.format(n, script, duration))
         else:
-            p = dict()
+            scripts_logger.error('Script {} ({}) exited with code {} after {:.2f}s'
+                                 .format(n, script, process.returncode, duration))
+
+    for name, data in (('stdout', stdout), ('stderr', stderr)):
+        if data and data.strip():
+            level = logging.DEBUG if ok or name == 'stdout' else logging.WARNING
+            scripts_logger.log(level, 'Script {} {}:\n{}'.format(n, name, data.decode('utf-8', 'replace').rstrip()))
+    return ok
+
 
-        p['workbench.colorTheme'] = us_se['extras']['vscode']['themes'][theme_type]
+def _timed_script(trace, n, script, timeout):
+    with trace.span('script', script=n):
+        return _run_script(n, script, timeout)
 
-        with target_file.open(mode='w') as f:
-            json.dump(p, f, indent=4)
 
+def _wait_scripts(trace, executor, futures):
+    with trace.span('scripts'), executor:
+        results = [future.result() for future in futures]
 
-def run_scripts(scripts, notifications_enabled):
+    if not all(results):
+        logger.warning('One or more of the script files failed to run')
+
+
+#   Runs the scripts concurrently in the background, so switching themes never waits on them. The returned thread is
+#   not a daemon, so a short lived process still waits for the scripts to finish before exiting
+def run_scripts(scripts, timeout=SCRIPT_TIMEOUT):
     from automathemely import notifier_handler
-    from subprocess import run
+    import threading
 
-    # Temporarily remove notifier handler to not spam user of failed scripts
-    logging.getLogger().removeHandler(notifier_handler)
+    # Don't spam the user about each failed script
+    notifier_handler.addFilter(_not_from_scripts)
 
-    error_message = None
+    jobs = []
+    missing = False
     for n, script in scripts.items():
         if not script:
             continue
         elif not Path(script).expanduser().is_file():
-            logger.error('Script file {} not found'.format(n))
-            error_message = 'One or more of the script files was/were not found'
+            scripts_logger.error('Script file {} not found'.format(n))
+            missing = True
         else:
-            try:
-                run([os.path.expanduser(script)], check=True)
-            except Exception as e:
-                logger.exception('Error while running {}'.format(script), exc_info=e)
-                error_message = 'One or more of the script files failed to run'
-
-    # Add it back
-    if notifications_enabled:
-        logging.getLogger().addHandler(notifier_handler)
-
-    if error_message:
-        logger.warning(error_message)
+            jobs.append((n, script))
+
+    if missing:
+        logger.warning('One or more of the script files was/were not found')
+
+    if not jobs:
+        return
+
+    # Submitted from here, the thread below only waits on them. Once the interpreter is shutting down, which is where a
+    # short lived process is as soon as it's done switching, no thread can set up an executor or submit to it anymore
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor(max_workers=SCRIPT_WORKERS)
+    # Their timings belong to this switch, even if another one has started by the time they finish
+    trace = timings.current()
+    futures = [executor.submit(_timed_script, trace, n, script, timeout) for n, script in jobs]
+
+    thread = threading.Thread(target=_wait_scripts, args=(trace, executor, futures), name='scripts')
+    thread.start()
+    return thread
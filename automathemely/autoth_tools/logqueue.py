@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import atexit
+import logging
+import queue
+import sys
+import threading
+
+# Records waiting to be written, once it's full the oldest ones are dropped to make room
+QUEUE_SIZE = 1000
+# How long exiting waits for the remaining records to be written (e.g. if the notification daemon hangs)
+FLUSH_TIMEOUT = 5
+
+
+#   Does the actual writing of records (to files, the console, notifications...) on a background thread, so whoever
+#   logs never waits on it. It's the same idea as logging.handlers' QueueHandler and QueueListener, but importing that
+#   module would cost more than everything else the CLI imports at startup
+class LogPipeline:
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = False
+        self.dropped = 0
+        # How many records were queued and how many are done with (written or dropped), drain() waits on these instead
+        # of a marker in the queue, which could be dropped along with the records when it's full
+        self.progress = threading.Condition()
+        self.queued = 0
+        self.done = 0
+
+    def put(self, sink, record):
+        if self.thread is None:
+            self._start()
+        # After flushing (at exit) there is nobody left to write them, so do it right away
+        if self.stopped:
+            self._write(sink, record)
+            return
+
+        with self.progress:
+            self.queued += 1
+        while True:
+            try:
+                self.queue.put_nowait((sink, record))
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                with self.progress:
+                    self.dropped += 1
+                    self.done += 1
+                    self.progress.notify_all()
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='logging', daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _write(sink, record):
+        if record.levelno >= sink.level:
+            sink.handle(record)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            finally:
+                with self.progress:
+                    self.done += 1
+                    self.progress.notify_all()
+
+    #   Wait for what was logged so far to be written, e.g. before printing to the console so they don't get mixed up
+    def drain(self, timeout=FLUSH_TIMEOUT):
+        if self.thread is None or self.stopped:
+            return
+
+        with self.progress:
+            queued = self.queued
+            self.progress.wait_for(lambda: self.done >= queued, timeout)
+
+    #   Write everything still queued and stop the thread, anything logged afterwards is written immediately
+    def flush(self):
+        if self.thread is None or self.stopped:
+            return
+
+        self.stopped = True
+        try:
+            self.queue.put(None, timeout=FLUSH_TIMEOUT)
+        except queue.Full:
+            pass
+        self.thread.join(FLUSH_TIMEOUT)
+
+        if self.dropped:
+            sys.stderr.write('{} log messages were dropped\n'.format(self.dropped))
+
+
+pipeline = LogPipeline()
+
+
+#   Filters and formats records right away (so they're not affected by whatever happens to their arguments later),
+#   then hands them over to the pipeline to be written by sink. Levels, filters and formatters should be set on this
+#   handler, not on the sink
+class QueuedHandler(logging.Handler):
+    def __init__(self, sink, level=logging.NOTSET):
+        super().__init__(level)
+        self.sink = sink
+
+    def prepare(self, record):
+        message = self.format(record)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            pipeline.put(self.sink, self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.sink.close()
+        super().close()
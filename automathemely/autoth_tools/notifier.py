@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import sys
+import threading
+import time
+
+from automathemely.autoth_tools.utils import get_resource
+
+# Messages posted within this many seconds of each other are shown together in a single notification
+COALESCE_WINDOW = 0.5
+# The same message isn't shown again until this many seconds later
+RATE_LIMIT = 30
+# At most this many messages in a notification, the rest are only counted
+MAX_LINES = 5
+
+# I don't even know... https://bugzilla.redhat.com/show_bug.cgi?id=1582833
+IGNORED_ERRORS = ('g-dbus-error-quark: Unexpected reply type (16)',
+                  'g-dbus-error-quark: GDBus.Error:org.freedesktop.DBus.Error.NoReply: Message recipient disconnected '
+                  'from message bus without replying (4)')
+
+
+#   Desktop notifications through a single libnotify connection and notification, which is updated in place instead
+#   of stacking up new ones. Messages posted in a burst are merged into one notification, and repeating ones are rate
+#   limited, so something that keeps failing can't flood the notification daemon
+class Notifier:
+    def __init__(self, title='AutomaThemely', window=COALESCE_WINDOW, rate_limit=RATE_LIMIT):
+        self.title = title
+        self.window = window
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.notification = None
+        self.pending = []
+        self.last_shown = dict()
+        self.timer = None
+
+    def _get_notification(self):
+        if self.notification is None:
+            import gi
+            gi.require_version('Notify', '0.7')
+            from gi.repository import Notify
+
+            if not Notify.is_initted():
+                Notify.init('AutomaThemely')
+            self.notification = Notify.Notification.new(self.title, '', get_resource('automathemely.svg'))
+        return self.notification
+
+    #   Show message right away, replacing whatever this notifier showed last
+    def show(self, message, title=None):
+        from gi.repository import GLib
+
+        with self.lock:
+            notification = self._get_notification()
+            notification.update(title or self.title, message, get_resource('automathemely.svg'))
+            try:
+                notification.show()
+            except GLib.GError as e:
+                if str(e) not in IGNORED_ERRORS:
+                    raise e
+
+    #   Queue message up to be shown along with whatever else is posted within the coalescing window. key identifies
+    #   the message for rate limiting, by default the message itself
+    def post(self, message, key=None):
+        key = message if key is None else key
+        now = time.monotonic()
+        with self.lock:
+            last_shown = self.last_shown.get(key)
+            if last_shown is not None and now - last_shown < self.rate_limit:
+                return
+            self.last_shown[key] = now
+
+            self.pending.append(message)
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    #   Show what's pending right away
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            pending, self.pending = self.pending, []
+            # Forget keys that can be shown again, so the dict doesn't grow forever in the scheduler
+            now = time.monotonic()
+            self.last_shown = {k: t for k, t in self.last_shown.items() if now - t < self.rate_limit}
+
+        if not pending:
+            return
+
+        lines = pending[:MAX_LINES]
+        if len(pending) > MAX_LINES:
+            lines.append('...and {} more'.format(len(pending) - MAX_LINES))
+        # Usually called from the timer's thread, with nobody to pass errors to. Not logged since they may well end up
+        # here again
+        try:
+            self.show('\n'.join(lines))
+        except Exception as e:
+            sys.stderr.write('Could not show a notification ({})\n'.format(e))
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = Notifier()
+        return _notifier
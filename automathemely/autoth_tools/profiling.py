@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from automathemely.autoth_tools.utils import get_local
+
+logger = logging.getLogger(__name__)
+
+PROFILE_KINDS = ('cpu', 'alloc')
+# Older reports are deleted
+KEEP_PROFILES = 20
+# How many allocation sites alloc reports list, and how deep their tracebacks go
+TOP_ALLOCATIONS = 50
+ALLOC_FRAMES = 10
+
+
+def _report_path(name, extension):
+    directory = get_local('profiles')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, '{}-{}-{}.{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), name,
+                                                        extension))
+
+
+def _prune():
+    directory = get_local('profiles')
+    try:
+        reports = sorted((e for e in os.scandir(directory) if e.is_file()), key=lambda e: e.stat().st_mtime,
+                         reverse=True)
+    except OSError:
+        return
+
+    for entry in reports[KEEP_PROFILES:]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+def _write_alloc_report(path, snapshot):
+    import tracemalloc
+
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')))
+    stats = snapshot.statistics('traceback')
+    total = sum(stat.size for stat in stats)
+
+    with open(path, 'w') as f:
+        f.write('{:.1f} KiB allocated and still alive in {} blocks\n'.format(total / 1024,
+                                                                            sum(stat.count for stat in stats)))
+        for n, stat in enumerate(stats[:TOP_ALLOCATIONS], 1):
+            f.write('\n#{}: {:.1f} KiB in {} blocks\n'.format(n, stat.size / 1024, stat.count))
+            for line in stat.traceback.format(most_recent_first=True):
+                f.write(line + '\n')
+
+
+#   Profile whatever runs in the block (in the current thread for cpu, in all of them for alloc) and save the report
+#   to the profiles dir, named after name. kind is one of PROFILE_KINDS, anything else doesn't profile at all so it can
+#   be passed straight from the settings
+@contextmanager
+def profiled(kind, name):
+    if kind not in PROFILE_KINDS:
+        yield
+        return
+
+    if kind == 'cpu':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        import tracemalloc
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start(ALLOC_FRAMES)
+
+    try:
+        yield
+    finally:
+        try:
+            if kind == 'cpu':
+                profiler.disable()
+                path = _report_path(name, 'pstats')
+                profiler.dump_stats(path)
+            else:
+                snapshot = tracemalloc.take_snapshot()
+                if not already_tracing:
+                    tracemalloc.stop()
+                path = _report_path(name, 'txt')
+                _write_alloc_report(path, snapshot)
+        except OSError as e:
+            logger.warning('Could not save the {} profile ({})'.format(kind, e))
+        else:
+            logger.debug('Saved the {} profile to {}'.format(kind, path))
+            _prune()
@@ -4,19 +4,32 @@ import gi
 gi.require_version('Gtk', '3.0')
 
 # noinspection PyPep8
-from gi.repository import Gtk, Gio
+from gi.repository import Gtk, Gio, GLib
 # noinspection PyPep8
 from automathemely.autoth_tools.utils import get_resource, get_local, read_dict, write_dic
 # noinspection PyPep8
-from automathemely.autoth_tools import extratools, envspecific
+from automathemely.autoth_tools import extratools, envspecific, ctlsocket
+# noinspection PyPep8
+from automathemely.autoth_tools.themewatch import ThemeWatcher
 # noinspection PyPep8
 import json
 
 # noinspection PyPep8
 import subprocess  # For running external theme commands
+# noinspection PyPep8
+import threading
+# noinspection PyPep8
+from collections import namedtuple
 import logging
 logger = logging.getLogger(__name__)
 
+# Placeholder item shown in extras' CBoxTs while their themes are being looked for
+LOADING_ID = '___loading___'
+
+
+# Where in user_settings a widget's data goes, and which part of the GUI it affects, if any (see below)
+Binding = namedtuple('Binding', ('keys', 'subordinate'))
+
 
 def split_id_delimiter(obj_id):
     obj_id = obj_id.lstrip('*')
@@ -98,6 +111,12 @@ def display_row_separators(row, before):
         row.set_header(Gtk.Separator())
 
 
+# Through the scheduler if it's running, otherwise with a whole new process
+def apply_mode_now(mode):
+    if not ctlsocket.send_command('apply', mode=mode):
+        subprocess.run(["automathemely", "--{}".format(mode)])
+
+
 def get_last_visible_row(max_number_of_rows, listbox_id, builder):
     for i in range(max_number_of_rows, 1, -1):
         entry = builder.get_object('{}.{}'.format(listbox_id, str(i)))
@@ -143,10 +162,24 @@ class App(Gtk.Application):
         self.builder.set_application(self)
         self.builder.connect_signals(self)
 
+        # Widget IDs parsed into Bindings, each one only once
+        self.bindings = dict()
+        # Each desktop environment's notebook is a separate file, only built the first time it is displayed
+        self.loaded_deskenvs = set()
+
         # This does not get initialized until needed
         self.extras = dict()
-
-        self.system_themes = envspecific.get_installed_themes(self.us_se['desktop_environment'])
+        # Extras whose themes are being looked for in the background
+        self.extras_loading = set()
+
+        # System themes are looked for in the background so the window doesn't wait for the filesystem, starting
+        # with the current desktop environment and then the rest in case the user switches to them
+        self.desk_env = self.us_se['desktop_environment']
+        self.system_themes = None
+        self.system_themes_by_env = dict()
+        self.system_themes_loading = set()
+        self.load_system_themes([self.desk_env] + [d for d in envspecific.SUPPORTED_DESKENVS if d != self.desk_env])
+        self.theme_watcher = None
 
         self.listen_changes = False
         self.saved_settings = False
@@ -177,25 +210,43 @@ class App(Gtk.Application):
             self.setup_all()
             self.listen_changes = True
 
+            # Themes installed or removed while the window is open show up right away
+            self.theme_watcher = ThemeWatcher()
+            self.theme_watcher.add_listener(self.find_changed_themes)
+            self.theme_watcher.start()
+
         self.main_window.present()
 
     def do_shutdown(self):
         Gtk.Application.do_shutdown(self)
 
+        if self.theme_watcher:
+            self.theme_watcher.stop()
+
         #   Dump file
         if self.changed and self.saved_settings:
             with open(get_local('user_settings.json'), 'w') as file:
                 json.dump(self.us_se, file, indent=4)
             exit_message = 'Successfully saved settings'
+
+            # Let the scheduler know, if it's running
+            ctlsocket.send_command('reload', timeout=2)
         else:
             exit_message = 'No changes were made'
 
         logger.info(exit_message)
 
     #      MISC
-    # Called on primary activation
-    def setup_all(self):
-        for obj in self.builder.get_objects():
+    def get_binding(self, obj):
+        binding = self.bindings.get(obj)
+        if binding is None:
+            obj_path, obj_sub = split_id_delimiter(Gtk.Buildable.get_name(obj))
+            binding = self.bindings[obj] = Binding(tuple(obj_path.split('.')), obj_sub)
+        return binding
+
+    # Set up objects and fill them with their values from user_settings
+    def setup_objects(self, objects):
+        for obj in objects:
             try:
                 obj_id = Gtk.Buildable.get_name(obj)
             except TypeError:
@@ -213,9 +264,8 @@ class App(Gtk.Application):
 
                 #   These DO contain data
                 elif obj_id.startswith('*'):
-                    obj_path, obj_sub = split_id_delimiter(obj_id)
+                    keys, obj_sub = self.get_binding(obj)
                     obj_attr = obj.get_name()
-                    keys = obj_path.split('.')
                     val = read_dict(self.us_se, keys)
 
                     # Has to go before entry because a SpinButton is also an entry...
@@ -242,6 +292,30 @@ class App(Gtk.Application):
                                 val = 'custom'
                             obj.set_active_id(try_or_default_type(val, str))
 
+    # Build a desktop environment's notebook if it hasn't been yet, returns it
+    def load_deskenv(self, desk_env):
+        if desk_env not in self.loaded_deskenvs:
+            self.loaded_deskenvs.add(desk_env)
+            known_objects = set(self.builder.get_objects())
+            self.builder.add_from_file(get_resource('manager_gui_{}.glade'.format(desk_env)))
+            # Only connects the signals of the objects that were just added
+            self.builder.connect_signals(self)
+
+            # Glade can't share a size group between files, so move its widgets to the main one
+            size_group = self.builder.get_object('default_size_{}'.format(desk_env))
+            for widget in size_group.get_widgets():
+                size_group.remove_widget(widget)
+                self.builder.get_object('default_size').add_widget(widget)
+
+            self.builder.get_object('deskenvs_box').pack_start(self.builder.get_object(desk_env), False, True, 0)
+            self.setup_objects([obj for obj in self.builder.get_objects() if obj not in known_objects])
+
+        return self.builder.get_object(desk_env)
+
+    # Called on primary activation
+    def setup_all(self):
+        self.setup_objects(self.builder.get_objects())
+
         # Hardcoded setup scripts listboxes after their entries have already been setup
         scripts_listboxes = ['scripts_sunrise_listbox', 'scripts_sunset_listbox']
         for listbox in scripts_listboxes:
@@ -266,10 +340,9 @@ class App(Gtk.Application):
             return
 
         cboxt_id = Gtk.Buildable.get_name(cboxt)
-        cboxt_path = split_id_delimiter(cboxt_id)[0]
         cboxt_attr = cboxt.get_name()
 
-        val = read_dict(self.us_se, cboxt_path.split('.'))
+        val = read_dict(self.us_se, self.get_binding(cboxt).keys)
         themes = []
 
         if cboxt_id.startswith('*themes'):
@@ -307,37 +380,141 @@ class App(Gtk.Application):
             # So it doesn't continue populating repeated options on non-set CBoxTs
             cboxt.set_active_id('none')
 
+    # Repopulate an already populated theme ComboBoxText, keeping whatever is selected in it if it's still there
+    def refresh_themes_cboxt(self, cboxt):
+        active_id = cboxt.get_active_id()
+        listen_changes, self.listen_changes = self.listen_changes, False
+
+        cboxt.remove_all()
+        cboxt.set_sensitive(True)
+        # Doesn't have an active id anymore, so it gets populated again from scratch
+        self.populate_themes_cboxt(cboxt)
+        if active_id != LOADING_ID:
+            cboxt.set_active_id(active_id)
+
+        self.listen_changes = listen_changes
+
+    def show_loading(self, cboxt):
+        listen_changes, self.listen_changes = self.listen_changes, False
+
+        cboxt.remove_all()
+        cboxt.append(LOADING_ID, 'Looking for installed themes...')
+        cboxt.set_active_id(LOADING_ID)
+        cboxt.set_sensitive(False)
+
+        self.listen_changes = listen_changes
+
+    def load_system_themes(self, desk_envs):
+        desk_envs = [d for d in desk_envs if d in envspecific.SUPPORTED_DESKENVS and d not in self.system_themes_loading
+                     and d not in self.system_themes_by_env]
+        if desk_envs:
+            self.system_themes_loading.update(desk_envs)
+            threading.Thread(target=self.find_system_themes, args=(desk_envs,), daemon=True).start()
+
+    # Runs in a worker thread, so it must not touch any widgets
+    def find_system_themes(self, desk_envs):
+        for desk_env in desk_envs:
+            # noinspection PyBroadException
+            try:
+                themes = envspecific.get_installed_themes(desk_env)
+            except Exception as e:
+                logger.exception('Error while looking for {} themes'.format(desk_env), exc_info=e)
+                themes = None
+            GLib.idle_add(self.on_system_themes_found, desk_env, themes)
+
+    # Same as find_system_themes
+    def find_extra_themes(self, switch, extra_type):
+        # noinspection PyBroadException
+        try:
+            themes = extratools.get_installed_extra_themes(extra_type)
+        except Exception as e:
+            logger.exception('Error while looking for {} themes'.format(extra_type), exc_info=e)
+            themes = None
+
+        if themes:
+            extratools.cache_extra_themes(extra_type, themes)
+        GLib.idle_add(self.on_extra_themes_found, switch, extra_type, themes)
+
+    # Fill the current desktop environment's theme CBoxTs, or show they are loading if their themes aren't there yet
+    def populate_deskenv_cboxts(self):
+        env_cboxts = scan_comboboxtext_descendants(self.builder.get_object(self.desk_env), self.desk_env) or []
+        for env_box in env_cboxts:
+            if self.desk_env not in self.system_themes_by_env:
+                if not env_box.get_active_id():
+                    self.show_loading(env_box)
+            elif env_box.get_active_id() == LOADING_ID:
+                self.refresh_themes_cboxt(env_box)
+            else:
+                self.populate_themes_cboxt(env_box)
+
     #       HANDLERS
+    # noinspection PyAttributeOutsideInit
+    def on_system_themes_found(self, desk_env, themes):
+        self.system_themes_loading.discard(desk_env)
+        self.system_themes_by_env[desk_env] = themes
+
+        if desk_env == self.desk_env:
+            self.system_themes = themes
+            self.populate_deskenv_cboxts()
+
+        return GLib.SOURCE_REMOVE
+
+    # Called from the watcher's thread, the theme index may still be busy (e.g. rescanning) so the lists are fetched
+    # here and only the results are handed over to the main thread
+    def find_changed_themes(self, kinds):
+        themes_by_env = {desk_env: envspecific.get_installed_themes(desk_env)
+                         for desk_env in list(self.system_themes_by_env)}
+        GLib.idle_add(self.on_themes_changed, kinds, themes_by_env)
+
+    # noinspection PyAttributeOutsideInit
+    def on_themes_changed(self, kinds, themes_by_env):
+        logger.debug('Installed themes changed ({})'.format(', '.join(sorted(kinds))))
+
+        self.system_themes_by_env.update(themes_by_env)
+
+        for desk_env in envspecific.SUPPORTED_DESKENVS:
+            # Desktop environments not displayed yet get populated when they are
+            cboxts = [c for c in scan_comboboxtext_descendants(self.builder.get_object(desk_env), desk_env) or []
+                      if Gtk.Buildable.get_name(c).startswith('*themes') and c.get_active_id()
+                      and c.get_active_id() != LOADING_ID]
+            if not cboxts or desk_env not in self.system_themes_by_env:
+                continue
+
+            self.system_themes = self.system_themes_by_env[desk_env]
+            for cboxt in cboxts:
+                self.refresh_themes_cboxt(cboxt)
+
+        self.system_themes = self.system_themes_by_env.get(self.desk_env)
+        return GLib.SOURCE_REMOVE
+
     # noinspection PyAttributeOutsideInit
     def on_update_deskenv(self, cboxt, *args):
         cboxt_val = cboxt.get_active_id()
 
-        self.system_themes = envspecific.get_installed_themes(cboxt_val)
+        self.desk_env = cboxt_val
+        self.system_themes = self.system_themes_by_env.get(cboxt_val)
 
         revealer = self.builder.get_object('deskenvs_revealer')
-        notebooks = self.builder.get_object('deskenvs_box').get_children()
 
         if cboxt_val == 'custom':
             revealer.set_reveal_child(False)
         else:
-            # Populate CBoxTs before displaying
-            env_notebook = self.builder.get_object(cboxt_val)
-            env_cboxts = scan_comboboxtext_descendants(env_notebook, cboxt_val)
-
-            for env_box in env_cboxts:
-                self.populate_themes_cboxt(env_box)
+            # Populate CBoxTs before displaying, they get filled as soon as their themes are found if they aren't yet
+            self.load_deskenv(cboxt_val)
+            self.load_system_themes([cboxt_val])
+            self.populate_deskenv_cboxts()
 
             revealer.set_reveal_child(True)
 
-            for obj in notebooks:
+            # Listed only now, so the notebook that was just loaded is among them
+            for obj in self.builder.get_object('deskenvs_box').get_children():
                 if Gtk.Buildable.get_name(obj) == cboxt_val:
                     obj.set_visible(True)
                 else:
                     obj.set_visible(False)
 
     def on_container_toggle(self, switch, *args):
-        switch_id = Gtk.Buildable.get_name(switch)
-        container = split_id_delimiter(switch_id)[1]
+        container = self.get_binding(switch).subordinate
         switch_attr = switch.get_name()
 
         container_obj = self.builder.get_object(container)
@@ -356,27 +533,49 @@ class App(Gtk.Application):
     # extras' CBoxTs are populated only if they are enabled to begin with or if they are enabled while it is running
     def on_enable_extra(self, switch, *args):
         if switch.get_active():
-            switch_id = Gtk.Buildable.get_name(switch)
-            switch_path, container = split_id_delimiter(switch_id)
-            extra_type = switch_path.split('.')[1]
+            keys, container = self.get_binding(switch)
+            extra_type = keys[1]
+            extras_cboxts = scan_comboboxtext_descendants(self.builder.get_object(container), extra_type)
 
-            # This is the culprit
-            self.extras[extra_type] = extratools.get_installed_extra_themes(extra_type)
-
-            if self.extras[extra_type]:
-                extras_cboxts = scan_comboboxtext_descendants(self.builder.get_object(container), extra_type)
+            # Whatever was found last time is good enough to start with, it gets updated once the search is done
+            if extra_type not in self.extras:
+                self.extras[extra_type] = extratools.get_cached_extra_themes(extra_type)
                 for extra_cboxt in extras_cboxts:
-                    self.populate_themes_cboxt(extra_cboxt)
-            else:
-                switch.set_active(False)
-                switch.set_sensitive(False)
-                return
+                    if self.extras[extra_type]:
+                        self.populate_themes_cboxt(extra_cboxt)
+                    else:
+                        self.show_loading(extra_cboxt)
+
+            # This is the culprit, so it's done in the background
+            if extra_type not in self.extras_loading:
+                self.extras_loading.add(extra_type)
+                threading.Thread(target=self.find_extra_themes, args=(switch, extra_type), daemon=True).start()
+
+    def on_extra_themes_found(self, switch, extra_type, themes):
+        self.extras_loading.discard(extra_type)
+        container = self.get_binding(switch).subordinate
+        extras_cboxts = scan_comboboxtext_descendants(self.builder.get_object(container), extra_type)
+
+        if themes:
+            if themes != self.extras.get(extra_type) or any(c.get_active_id() == LOADING_ID for c in extras_cboxts):
+                self.extras[extra_type] = themes
+                for extra_cboxt in extras_cboxts:
+                    self.refresh_themes_cboxt(extra_cboxt)
+        else:
+            # Not installed (anymore)
+            self.extras[extra_type] = None
+            for extra_cboxt in extras_cboxts:
+                if extra_cboxt.get_active_id() == LOADING_ID:
+                    extra_cboxt.remove_all()
+            switch.set_active(False)
+            switch.set_sensitive(False)
+
+        return GLib.SOURCE_REMOVE
 
     # These three functions related to scripts are kinda not great, and will probably change a lot in future revisions
     # because they were mostly an afterthought
     def on_remove_scripts_row(self, button, *args):
-        button_id = Gtk.Buildable.get_name(button)
-        sub_entry = split_id_delimiter(button_id)[1]
+        sub_entry = self.get_binding(button).subordinate
         listbox_type = sub_entry.split('.')[2]
         row_number = int(sub_entry.split('.')[-1])
 
@@ -450,8 +649,7 @@ class App(Gtk.Application):
 
     def on_any_change(self, emitter, *args):
         if self.listen_changes:
-            emitter_path = split_id_delimiter(Gtk.Buildable.get_name(emitter))[0]
-            if get_object_data(emitter) != read_dict(self.us_se, emitter_path.split('.')):
+            if get_object_data(emitter) != read_dict(self.us_se, self.get_binding(emitter).keys):
                 if not (emitter in self.changed):
                     self.changed.append(emitter)
             else:
@@ -491,8 +689,7 @@ class App(Gtk.Application):
             self.sub_windows['error_dialog'].hide()
         else:
             for change_obj in self.changed:
-                change_path = split_id_delimiter(Gtk.Buildable.get_name(change_obj))[0]
-                write_dic(self.us_se, change_path.split('.'), get_object_data(change_obj))
+                write_dic(self.us_se, self.get_binding(change_obj).keys, get_object_data(change_obj))
             self.saved_settings = True
             self.quit()
                            
@@ -501,14 +698,14 @@ class App(Gtk.Application):
         """Handler to activate Light theme."""
         if button.get_active():
             logger.info('Light theme toggle clicked.')
-            subprocess.run(["automathemely", "-L"])
+            apply_mode_now('light')
             logger.info('Switched to Light theme.')
 
     def on_toggle_dark_theme(self, button):
         """Handler to activate Dark theme."""
         if button.get_active():
             logger.info('Dark theme toggle clicked.')
-            subprocess.run(["automathemely", "-D"])
+            apply_mode_now('dark')
             logger.info('Switched to Dark theme.')
 
 def main(user_settings):
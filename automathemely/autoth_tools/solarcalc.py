@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Vectorized version of the NOAA sunrise/sunset algorithm used by astral (astral.sun.time_of_transit), meant for
+# computing a lot of days for a lot of places in one go. It follows astral step by step so results stay the same
+import numpy as np
+
+SUN_APPARENT_RADIUS = 32.0 / (60.0 * 2.0)
+# Zenith angles for the supported events, twilights are given by the depression of the sun below the horizon
+ZENITHS = {
+    'sunrise': 90.0 + SUN_APPARENT_RADIUS,
+    'sunset': 90.0 + SUN_APPARENT_RADIUS,
+    'dawn': 90.0 + 6.0,
+    'dusk': 90.0 + 6.0,
+    'nautical_dawn': 90.0 + 12.0,
+    'nautical_dusk': 90.0 + 12.0
+}
+RISING_EVENTS = ('sunrise', 'dawn', 'nautical_dawn')
+
+# Unix epoch as a Julian Day
+EPOCH_JULIANDAY = 2440587.5
+
+
+def refraction_at_zenith(zenith):
+    elevation = 90.0 - zenith
+    te = np.tan(np.radians(elevation))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correction = np.select(
+            [elevation >= 85.0, elevation > 5.0, elevation > -0.575],
+            [0.0,
+             58.1 / te - 0.07 / te ** 3 + 0.000086 / te ** 5,
+             1735.0 + elevation * (-518.2 + elevation * (103.4 + elevation * (-12.79 + elevation * 0.711)))],
+            -20.774 / te
+        )
+
+    return correction / 3600.0
+
+
+def _sun_declination_and_eq_of_time(jc):
+    l0 = (280.46646 + jc * (36000.76983 + 0.0003032 * jc)) % 360.0
+    m = 357.52911 + jc * (35999.05029 - 0.0001537 * jc)
+    e = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+
+    m_rad = np.radians(m)
+    c = (np.sin(m_rad) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+         + np.sin(2.0 * m_rad) * (0.019993 - 0.000101 * jc)
+         + np.sin(3.0 * m_rad) * 0.000289)
+
+    omega = np.radians(125.04 - 1934.136 * jc)
+    apparent_long = l0 + c - 0.00569 - 0.00478 * np.sin(omega)
+
+    seconds = 21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))
+    obliquity = 23.0 + (26.0 + seconds / 60.0) / 60.0 + 0.00256 * np.cos(omega)
+
+    declination = np.degrees(np.arcsin(np.sin(np.radians(obliquity)) * np.sin(np.radians(apparent_long))))
+
+    y = np.tan(np.radians(obliquity) / 2.0) ** 2
+    l0_rad = np.radians(l0)
+    eq_of_time = 4.0 * np.degrees(y * np.sin(2.0 * l0_rad)
+                                  - 2.0 * e * np.sin(m_rad)
+                                  + 4.0 * e * y * np.sin(m_rad) * np.cos(2.0 * l0_rad)
+                                  - 0.5 * y * y * np.sin(4.0 * l0_rad)
+                                  - 1.25 * e * e * np.sin(2.0 * m_rad))
+
+    return declination, eq_of_time
+
+
+#   Minutes after midnight UTC of days (days since the epoch) at which the sun transits the zenith, NaN if it doesn't
+def _time_of_transit(days, latitude, longitude, zenith, rising):
+    latitude = np.clip(latitude, -89.8, 89.8)
+    zenith = zenith + refraction_at_zenith(zenith)
+    latitude_rad = np.radians(latitude)
+    zenith_cos = np.cos(np.radians(zenith))
+
+    jd = days + EPOCH_JULIANDAY
+    # The first pass only depends on the date, so it's computed once for all sites
+    adjustment = np.zeros_like(jd)
+    time_utc = None
+
+    for _ in range(2):
+        declination, eq_of_time = _sun_declination_and_eq_of_time((jd + adjustment - 2451545.0) / 36525.0)
+        declination_rad = np.radians(declination)
+
+        h = (zenith_cos - np.sin(latitude_rad) * np.sin(declination_rad)) / (
+            np.cos(latitude_rad) * np.cos(declination_rad))
+        # Out of [-1, 1] means the sun never gets there that day, which becomes NaN
+        with np.errstate(invalid='ignore'):
+            hour_angle = np.arccos(h)
+        if not rising:
+            hour_angle = -hour_angle
+
+        offset = (-longitude - np.degrees(hour_angle)) * 4.0 - eq_of_time
+        offset = np.where(offset < -720.0, offset + 1440.0, offset)
+
+        time_utc = 720.0 + offset
+        adjustment = time_utc / 1440.0
+
+    return time_utc
+
+
+#   Compute an event for every combination of sites and dates
+#
+#   dates can be anything numpy can turn into datetime64[D] (e.g. a list of datetime.date), latitudes and longitudes
+#   are the coordinates of each site in degrees and utc_offsets the offset of their timezones in seconds, either one
+#   per site or one per site and date. Like astral, the event is searched on the date as seen in the site's timezone.
+#
+#   Returns a (sites, dates) array of UTC epoch seconds, NaN where the event doesn't happen (polar day/night)
+def transit_times(dates, latitudes, longitudes, event='sunrise', utc_offsets=0):
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64).astype(np.float64)[np.newaxis, :]
+    latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))[:, np.newaxis]
+    longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))[:, np.newaxis]
+    utc_offsets = np.asarray(utc_offsets, dtype=np.float64)
+    if utc_offsets.ndim == 1:
+        utc_offsets = utc_offsets[:, np.newaxis]
+
+    zenith = ZENITHS[event]
+    rising = event in RISING_EVENTS
+
+    times = days * 86400.0 + _time_of_transit(days, latitudes, longitudes, zenith, rising) * 60.0
+    days, latitudes, longitudes, utc_offsets = np.broadcast_arrays(days, latitudes, longitudes, utc_offsets)
+
+    # If the event falls on another local date, look for it on the neighbouring day instead. This only happens for
+    # a few sites far from their timezone's meridian, so only those get recomputed
+    with np.errstate(invalid='ignore'):
+        local_days = np.floor((times + utc_offsets) / 86400.0)
+        shift = np.nan_to_num(days - local_days)
+        redo = shift != 0
+    if redo.any():
+        shifted_days = days[redo] + shift[redo]
+        times[redo] = shifted_days * 86400.0 + _time_of_transit(shifted_days, latitudes[redo], longitudes[redo],
+                                                                zenith, rising) * 60.0
+
+        # Still on another date means there is no such event on the requested one
+        with np.errstate(invalid='ignore'):
+            mismatch = np.floor((times[redo] + utc_offsets[redo]) / 86400.0) != days[redo]
+        times[redo] = np.where(mismatch, np.nan, times[redo])
+
+    return times
+
+
+def sun_times(dates, latitudes, longitudes, utc_offsets=0, events=tuple(ZENITHS)):
+    return {event: transit_times(dates, latitudes, longitudes, event, utc_offsets) for event in events}
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import struct
+import time
+from datetime import date, datetime, timezone
+
+from automathemely.autoth_tools.utils import get_local, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Sunrise and sunset times are computed in one go for this many days, so nothing has to run daily to refresh them
+TABLE_DAYS = 366
+# Rebuild a little before running out, so there is always a next transition to schedule
+MIN_DAYS_LEFT = 2
+
+# On disk the table is a fixed size header followed by one fixed size record per day, sorted by date, all little
+# endian. Records can be looked up right from an mmap of the file without reading the whole thing
+MAGIC = b'ATST'
+FORMAT_VERSION = 1
+# Magic, format version, record size, settings key, sunrise offset, sunset offset (both in minutes), record count
+HEADER = struct.Struct('<4sHHqiiI')
+# Date as a proleptic Gregorian ordinal, sunrise and sunset as UTC epoch seconds
+RECORD = struct.Struct('<iqq')
+
+
+class SunTable:
+    def __init__(self, buffer):
+        if len(buffer) < HEADER.size:
+            raise ValueError('Truncated header')
+
+        magic, version, record_size, self.key, self.sunrise_offset, self.sunset_offset, self.count = \
+            HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError('Not a sun times table')
+        elif version != FORMAT_VERSION or record_size != RECORD.size:
+            raise ValueError('Unsupported format version {}'.format(version))
+        elif self.count == 0 or len(buffer) < HEADER.size + self.count * RECORD.size:
+            raise ValueError('Truncated records')
+
+        self.buffer = buffer
+
+    def __len__(self):
+        return self.count
+
+    # (day ordinal, sunrise, sunset) of the i-th record
+    def record(self, i):
+        return RECORD.unpack_from(self.buffer, HEADER.size + i * RECORD.size)
+
+    # Index of the first record whose field (0: day, 1: sunrise, 2: sunset) is greater than value
+    def bisect(self, field, value):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value < self.record(mid)[field]:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def first_day(self):
+        return self.record(0)[0]
+
+    def last_day(self):
+        return self.record(self.count - 1)[0]
+
+    def to_bytes(self):
+        return bytes(self.buffer[:HEADER.size + self.count * RECORD.size])
+
+
+def pack(key, offsets, entries):
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size, key, int(offsets['sunrise']), int(offsets['sunset']),
+                         len(entries))
+    return header + b''.join(RECORD.pack(*entry) for entry in entries)
+
+
+#   The table is only valid for the location and offsets it was computed with
+def settings_key(us_se):
+    relevant = json.dumps([us_se['location'], us_se['offset']], sort_keys=True)
+    # Small enough to be stored as a signed 64 bit integer
+    return int(hashlib.sha1(relevant.encode('utf-8')).hexdigest()[:15], 16)
+
+
+def build(us_se, days=TABLE_DAYS):
+    from automathemely.autoth_tools import updsuntimes
+
+    entries = updsuntimes.main(us_se, days)
+    if not entries:
+        return
+
+    return SunTable(pack(settings_key(us_se), us_se['offset'],
+                         [(day.toordinal(), int(sunrise.timestamp()), int(sunset.timestamp()))
+                          for day, sunrise, sunset in entries]))
+
+
+def save(table):
+    # Several processes may be rebuilding at the same time, but none of them can leave a half written file around
+    atomic_write(get_local('sun_times'), table.to_bytes())
+
+
+def load():
+    import mmap
+    try:
+        with open(get_local('sun_times'), 'rb') as file:
+            # The mapping stays valid after closing the file, and a rename over it by save() doesn't affect it either
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        # ValueError means the file is empty
+        return
+
+    try:
+        return SunTable(buffer)
+    except ValueError as e:
+        # Older versions stored a pickle with a single day
+        logger.debug('Ignoring times file ({})'.format(e))
+        return
+
+
+def is_valid(table, us_se, day=None):
+    if not table or table.key != settings_key(us_se):
+        return False
+
+    ordinal = (day or date.today()).toordinal()
+    return table.first_day() <= ordinal and table.last_day() - ordinal >= MIN_DAYS_LEFT
+
+
+#   Whether the table was computed for these settings and still has a transition coming up, even if it's about to run
+#   out and should be rebuilt
+def is_usable(table, us_se, now=None):
+    return bool(table) and table.key == settings_key(us_se) and next_transition(table, now) is not None
+
+
+def update(us_se):
+    table = build(us_se)
+    if table:
+        save(table)
+    return table
+
+
+def get_table(us_se):
+    table = load()
+    if not is_valid(table, us_se):
+        logger.info('No valid times file found, creating one...')
+        new_table = update(us_se)
+        if new_table:
+            return new_table
+        # E.g. offline with automatic location, the old table is better than nothing while it lasts
+        elif is_usable(table, us_se):
+            logger.warning('Could not update the sunrise and sunset times, using the old ones for now')
+            return table
+        return
+    return table
+
+
+#   Sunrise and sunset for the given day (today by default) as aware UTC datetimes
+def lookup(table, day=None):
+    ordinal = (day or date.today()).toordinal()
+    # If the sun doesn't rise or set on that day there is no entry for it, so fall back to the closest one before
+    _, sunrise, sunset = table.record(max(table.bisect(0, ordinal) - 1, 0))
+    return datetime.fromtimestamp(sunrise, timezone.utc), datetime.fromtimestamp(sunset, timezone.utc)
+
+
+#   First transition after now as (epoch seconds, theme color), or None if the table has run out
+def next_transition(table, now=None):
+    if now is None:
+        now = time.time()
+
+    candidates = []
+    for field, t_color in ((1, 'light'), (2, 'dark')):
+        i = table.bisect(field, now)
+        if i < len(table):
+            candidates.append((table.record(i)[field], t_color))
+
+    return min(candidates) if candidates else None
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import json
+import logging
+from pathlib import Path
+
+from automathemely.autoth_tools.timings import span
+from automathemely.autoth_tools.utils import get_resource, get_local, update_dict, parse_version
+
+logger = logging.getLogger(__name__)
+
+
+def load_user_settings():
+    from automathemely import __version__ as version
+
+    first_time_run = False
+
+    #   Test for settings file and if it doesn't exist copy it from defaults
+    if not Path(get_local('user_settings.json')).is_file():
+        import shutil
+        shutil.copy2(get_resource('default_user_settings.json'), get_local('user_settings.json'))
+        # By default notifications are enabled
+        from automathemely import notifier_handler
+        logging.getLogger().addHandler(notifier_handler)
+        logger.info('No valid config file found, creating one...')
+        first_time_run = True
+
+    try:
+        with open(get_local('user_settings.json'), 'r') as f:
+            user_settings = json.load(f)
+    except json.decoder.JSONDecodeError:
+        user_settings = dict()
+
+    #   If settings files versions don't match (in case of an update for instance), overwrite values of
+    #   default_settings with user_settings and use that instead
+
+    logger.debug('Program version = {}'.format(version))
+    logger.debug('File version = {}'.format(str(user_settings['version'])))
+    if 'version' not in user_settings or str(user_settings['version']) != version:
+        with span('version_merge'):
+            with open(get_resource('default_user_settings.json'), 'r') as f:
+                default_settings = json.load(f)
+
+            # Hardcoded attempt to try to import old structure to new structure...
+            if parse_version(str(user_settings['version'])) <= parse_version('1.2'):
+                logger.debug('Lower version!')
+                user_settings['themes']['gnome'] = dict()
+                user_settings['themes']['gnome']['light'], user_settings['themes']['gnome']['dark'] = dict(), dict()
+                user_settings['themes']['gnome']['light']['gtk'] = user_settings['themes'].pop('light', '')
+                user_settings['themes']['gnome']['dark']['gtk'] = user_settings['themes'].pop('dark', '')
+
+            user_settings = update_dict(default_settings, user_settings)
+            user_settings['version'] = version
+
+    return user_settings, first_time_run
+
+
+#   Today's sunrise and sunset, or None if they can't be determined
+def load_sun_times(user_settings):
+    from automathemely.autoth_tools import suntable
+
+    with span('sun_times'):
+        table = suntable.get_table(user_settings)
+        if not table:
+            return
+
+        return suntable.lookup(table)
+
+
+def get_auto_mode(sunrise, sunset):
+    from datetime import datetime, timezone
+
+    # https://github.com/regebro/tzlocal/issues/74
+    local_tz = datetime.now().astimezone().tzinfo
+
+    #   Convert to local timezone and ignore date
+    now = datetime.now(timezone.utc).astimezone(local_tz).time()
+    sunrise, sunset = sunrise.astimezone(local_tz).time(), sunset.astimezone(local_tz).time()
+
+    if sunrise < now < sunset:
+        return 'light'
+    else:
+        return 'dark'
+
+
+def apply_mode(user_settings, t_color):
+    from automathemely.autoth_tools import envspecific, extratools
+
+    logger.info('Switching to {} themes...'.format(t_color))
+
+    #   Change desktop environment theme
+    desk_env = user_settings['desktop_environment']
+    if desk_env != 'custom':
+        with span('apply_themes', desk_env=desk_env):
+            envspecific.apply_themes(desk_env, user_settings['themes'][desk_env][t_color])
+
+    #   Run user scripts, in the background
+    s_time = 'sunrise' if t_color == 'light' else 'sunset'
+    with span('run_scripts'):
+        scripts_thread = extratools.run_scripts(user_settings['extras']['scripts'][s_time])
+
+    #   Change extra themes
+    for k, v in user_settings['extras'].items():
+        if k != 'scripts' and v['enabled']:
+            with span('set_extra_theme', extra=k):
+                extratools.set_extra_theme(user_settings, k, t_color)
+
+    # So whoever exports the timings can wait for the scripts' ones
+    return scripts_thread
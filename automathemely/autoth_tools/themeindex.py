@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from automathemely.autoth_tools.utils import get_local, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Scanning is mostly waiting on stat calls (slow on network mounts or a cold cache), so it pays to have more of them
+# in flight than there are cores
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# Probes are handed out in batches, one future per theme costs about as much as the probe itself on a warm cache
+SCAN_BATCH = 64
+
+# Bump whenever the facts collected for each theme change, so old indexes get thrown away instead of misread
+INDEX_VERSION = 1
+
+
+#   What we need to know about every theme in each kind of themes dir, so get_installed_themes never has to look
+#   inside the themes themselves unless they change
+def _scan_general_theme(path):
+    return {
+        'gtk3': any(path.glob('gtk-3.*/gtk.css')),
+        'gtk2': any(path.glob('gtk-2.*/gtkrc')),
+        'cinnamon': path.joinpath('cinnamon').is_dir(),
+        'shell': path.joinpath('gnome-shell', 'gnome-shell.css').is_file()
+    }
+
+
+def _scan_icons_theme(path):
+    return {'icons': path.joinpath('index.theme').is_file()}
+
+
+def _scan_lookandfeel_theme(path):
+    import configparser
+
+    # Prioritize .desktop metadata files to .json ones just like systemsettings
+    try:
+        if path.joinpath('metadata.desktop').is_file():
+            metadata = configparser.ConfigParser(strict=False)
+            metadata.read(str(path.joinpath('metadata.desktop')))
+            return {'lookandfeel': metadata['Desktop Entry']['Name']}
+
+        elif path.joinpath('metadata.json').is_file():
+            with path.joinpath('metadata.json').open() as f:
+                return {'lookandfeel': json.load(f)['KPlugin']['Name']}
+
+    except (configparser.Error, KeyError, TypeError, ValueError, OSError) as e:
+        logger.warning('Could not read the metadata of {} ({})'.format(path, e))
+
+    return {'lookandfeel': None}
+
+
+def _list_subdirs(root):
+    try:
+        with os.scandir(root) as it:
+            # Uses the type from the directory listing itself, only symlinks need an extra stat
+            return [entry.name for entry in it if entry.is_dir()]
+    except OSError:
+        return []
+
+
+def _probe_batch(probe, batch):
+    return [probe(root, name) for root, name in batch]
+
+
+#   List the subdirs of every root and call probe(root, subdir) on each of them, all spread over a thread pool.
+#   Returns one [(subdir, probe result)] list per root, in the same order as roots
+def scan_roots(roots, probe, max_workers=None):
+    roots = list(roots)
+    if not roots:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max_workers or SCAN_WORKERS) as executor:
+        listings = list(executor.map(_list_subdirs, roots))
+        jobs = [(root, name) for root, names in zip(roots, listings) for name in names]
+        batches = [jobs[i:i + SCAN_BATCH] for i in range(0, len(jobs), SCAN_BATCH)]
+        results = [r for batch in executor.map(_probe_batch, [probe] * len(batches), batches) for r in batch]
+
+    scanned = {root: [] for root in roots}
+    for (root, name), result in zip(jobs, results):
+        scanned[root].append((name, result))
+    return [scanned[root] for root in roots]
+
+
+SCANNERS = {
+    'general': _scan_general_theme,
+    'icons': _scan_icons_theme,
+    'lookandfeel': _scan_lookandfeel_theme
+}
+
+
+#   Persistent index of the themes found in each themes dir. A dir is only scanned again when its mtime or inode
+#   changes, which happens whenever a theme is added, removed or renamed in it (or, for symlinks like the snap's
+#   "current", when it points somewhere else). So warm lookups are a single stat per dir
+class ThemeIndex:
+    def __init__(self, path=None):
+        self.path = path or get_local('theme_index.json')
+        self.dirs = dict()
+        self.dirty = False
+        # The themes dicts handed out are never modified afterwards, only replaced, so readers don't need the lock
+        self.lock = threading.RLock()
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        if isinstance(data, dict) and data.get('version') == INDEX_VERSION:
+            self.dirs = data.get('dirs', dict())
+
+    #   {theme dir name: facts} for every theme directly inside directory
+    def get(self, directory, kind):
+        return self.get_many([directory], kind)[0]
+
+    #   What is known about directory without checking whether it's still up to date
+    def peek(self, directory, kind):
+        cached = self.dirs.get('{}:{}'.format(kind, directory))
+        return cached['themes'] if cached else dict()
+
+    #   Same for several dirs at once, the ones that need rescanning are scanned in parallel
+    def get_many(self, directories, kind):
+        with self.lock:
+            return self._get_many(directories, kind)
+
+    def _get_many(self, directories, kind):
+        keys = ['{}:{}'.format(kind, directory) for directory in directories]
+        stale = dict()
+        for directory, key in zip(directories, keys):
+            try:
+                st = os.stat(directory)
+            except OSError:
+                if self.dirs.pop(key, None) is not None:
+                    self.dirty = True
+                continue
+
+            cached = self.dirs.get(key)
+            if not cached or cached['mtime'] != st.st_mtime_ns or cached['inode'] != st.st_ino:
+                stale[directory] = (key, st)
+
+        if stale:
+            logger.debug('Scanning {}'.format(', '.join(stale)))
+            scanner = SCANNERS[kind]
+            scanned = scan_roots(stale, lambda root, name: scanner(Path(root, name)))
+            for (key, st), themes in zip(stale.values(), scanned):
+                self.dirs[key] = {'mtime': st.st_mtime_ns, 'inode': st.st_ino, 'themes': dict(themes)}
+            self.dirty = True
+
+        return [self.dirs[key]['themes'] if key in self.dirs else dict() for key in keys]
+
+    #   Probe again only the given themes of directory, e.g. when a watcher saw them being added or removed. Returns
+    #   whether anything changed
+    def update_themes(self, directory, kind, names):
+        key = '{}:{}'.format(kind, directory)
+        with self.lock:
+            cached = self.dirs.get(key)
+            try:
+                st = os.stat(directory)
+            except OSError:
+                st = None
+            if not cached or not st:
+                old = cached['themes'] if cached else dict()
+                return self._get_many([directory], kind)[0] != old
+
+            scanner = SCANNERS[kind]
+            themes = dict(cached['themes'])
+            for name in names:
+                path = Path(directory, name)
+                if path.is_dir():
+                    themes[name] = scanner(path)
+                else:
+                    themes.pop(name, None)
+
+            changed = themes != cached['themes']
+            self.dirs[key] = {'mtime': st.st_mtime_ns, 'inode': st.st_ino, 'themes': themes}
+            self.dirty = True
+            return changed
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        try:
+            with self.lock:
+                data = json.dumps({'version': INDEX_VERSION, 'dirs': self.dirs})
+            atomic_write(self.path, data)
+        except OSError as e:
+            logger.warning('Could not save the theme index ({})'.format(e))
+        else:
+            self.dirty = False
+
+
+_index = None
+
+
+#   Loaded once per process, the GUI asks again every time the desktop environment changes
+def get_index():
+    global _index
+    if _index is None:
+        _index = ThemeIndex()
+    return _index
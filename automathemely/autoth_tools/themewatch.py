@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+from automathemely.autoth_tools.themeindex import get_index
+
+logger = logging.getLogger(__name__)
+
+# From <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+# Themes installed while we watch are watched themselves too, as package managers create the dir before its files
+THEME_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+
+# Wait for things to calm down before probing, so a theme being copied is only looked at once it's all there
+SETTLE_TIME = 1
+# How often dirs that don't exist (yet) are checked with inotify, or everything is checked without it
+POLL_INTERVAL = 10
+
+
+#   Every themes dir that get_installed_themes looks at, with the kind of themes it holds
+def get_watched_dirs():
+    from automathemely.autoth_tools.envspecific import PATH_CONSTANTS
+
+    watched = dict()
+    for directory in PATH_CONSTANTS['general-themes'] + PATH_CONSTANTS['special-paths']['gtk']:
+        watched[directory] = 'general'
+    for directory in PATH_CONSTANTS['icons-themes']:
+        watched[directory] = 'icons'
+    for directory in PATH_CONSTANTS['lookandfeel-themes']:
+        watched[directory] = 'lookandfeel'
+    return watched
+
+
+class _Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    #   [(watch descriptor, mask, name)] of everything pending
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+#   Keeps the theme index up to date while the process runs and tells listeners which kinds of themes changed.
+#   Listeners are called from the watcher's own thread
+class ThemeWatcher:
+    def __init__(self, index=None, watched_dirs=None):
+        self.index = index or get_index()
+        self.watched_dirs = watched_dirs or get_watched_dirs()
+        self.listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def _notify(self, kinds):
+        if not kinds:
+            return
+
+        self.index.save()
+        for listener in list(self.listeners):
+            # noinspection PyBroadException
+            try:
+                listener(kinds)
+            except Exception as e:
+                logger.exception('Error in theme listener', exc_info=e)
+
+    #   Rescan whole dirs, only what changed since the index was last updated is looked at again
+    def _resync(self, directories):
+        changed = set()
+        for directory in directories:
+            kind = self.watched_dirs[directory]
+            old = self.index.peek(directory, kind)
+            if self.index.get(directory, kind) != old:
+                changed.add(kind)
+        return changed
+
+    def start(self):
+        try:
+            inotify = _Inotify()
+        except (OSError, AttributeError) as e:
+            logger.debug('inotify not available ({}), polling theme dirs instead'.format(e))
+            target, args = self._run_polling, ()
+        else:
+            target, args = self._run_inotify, (inotify,)
+
+        self._thread = threading.Thread(target=target, args=args, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_polling(self):
+        while not self._stop.wait(POLL_INTERVAL):
+            self._notify(self._resync(self.watched_dirs))
+
+    def _run_inotify(self, inotify):
+        # Watch descriptor -> (themes dir, theme name or None for the themes dir itself)
+        watches = dict()
+        missing = set(self.watched_dirs)
+
+        def watch_missing():
+            for directory in list(missing):
+                try:
+                    watches[inotify.add_watch(directory, ROOT_MASK)] = (directory, None)
+                except OSError:
+                    continue
+                missing.discard(directory)
+
+        try:
+            watch_missing()
+            # Anything that changed while nobody was watching
+            self._notify(self._resync(self.watched_dirs))
+
+            pending = dict()
+            last_event = None
+            last_poll = time.monotonic()
+            while not self._stop.is_set():
+                timeout = SETTLE_TIME if pending else POLL_INTERVAL
+                if select.select([inotify.fd], [], [], timeout)[0]:
+                    resync = set()
+                    for wd, mask, name in inotify.read_events():
+                        if mask & IN_Q_OVERFLOW:
+                            resync.update(self.watched_dirs)
+                            continue
+
+                        directory, theme = watches.get(wd, (None, None))
+                        if directory is None:
+                            continue
+
+                        if mask & IN_IGNORED:
+                            del watches[wd]
+                            if theme is None:
+                                missing.add(directory)
+                                resync.add(directory)
+                        elif theme is None:
+                            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                                resync.add(directory)
+                            elif name:
+                                pending.setdefault(directory, set()).add(name)
+                                if mask & (IN_CREATE | IN_MOVED_TO):
+                                    try:
+                                        watches[inotify.add_watch(os.path.join(directory, name), THEME_MASK)] = \
+                                            (directory, name)
+                                    except OSError:
+                                        pass
+                        else:
+                            # Something changed inside a theme
+                            pending.setdefault(directory, set()).add(theme)
+
+                    if resync:
+                        self._notify(self._resync(resync))
+                    last_event = time.monotonic()
+
+                now = time.monotonic()
+                if pending and now - last_event >= SETTLE_TIME:
+                    changed = set()
+                    for directory, names in pending.items():
+                        kind = self.watched_dirs[directory]
+                        if self.index.update_themes(directory, kind, names):
+                            changed.add(kind)
+                    pending.clear()
+                    self._notify(changed)
+
+                if now - last_poll >= POLL_INTERVAL:
+                    last_poll = now
+                    if missing:
+                        appeared = {d for d in missing if os.path.isdir(d)}
+                        watch_missing()
+                        self._notify(self._resync(appeared - missing))
+        finally:
+            inotify.close()
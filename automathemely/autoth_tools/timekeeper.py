@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import threading
+import time
+
+# Reasons for DeadlineTimer.wait_until() to return
+DEADLINE = 'deadline'
+WAKEUP = 'wakeup'
+CLOCK_JUMP = 'clock-jump'
+RESUME = 'resume'
+
+# The actual sleeping is done on the monotonic clock (that's what Event.wait uses), which is immune to NTP or manual
+# changes of the wall clock but also blind to them, so we never sleep longer than this before checking the wall clock
+# again. Still only a couple hundred wakeups a day instead of one every second
+MAX_SLICE = 300
+# How far apart the wall clock and the monotonic clock can drift during a slice before we consider it a jump
+JUMP_TOLERANCE = 5
+# logind and the clocks drifting apart may both report the same resume, only the first one counts
+RESUME_COALESCE = 30
+
+
+# Unlike the monotonic clock this one keeps counting while the system is suspended
+def _boottime():
+    try:
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    except AttributeError:
+        return time.monotonic()
+
+
+class DeadlineTimer:
+    def __init__(self, max_slice=MAX_SLICE, jump_tolerance=JUMP_TOLERANCE):
+        self.max_slice = max_slice
+        self.jump_tolerance = jump_tolerance
+        self._wakeup = threading.Event()
+        self._reason = WAKEUP
+        self._resumed_at = None
+
+    # Interrupt a wait_until() currently in progress (e.g. from another thread), making it return reason
+    def wake(self, reason=WAKEUP):
+        self._reason = reason
+        self._wakeup.set()
+
+    def _is_new_resume(self):
+        now = _boottime()
+        if self._resumed_at is not None and now - self._resumed_at < RESUME_COALESCE:
+            return False
+        self._resumed_at = now
+        return True
+
+    # Block until the wall clock reaches deadline (a POSIX timestamp)
+    def wait_until(self, deadline):
+        while True:
+            wall_start, mono_start, boot_start = time.time(), time.monotonic(), _boottime()
+            remaining = deadline - wall_start
+            if remaining <= 0:
+                return DEADLINE
+
+            if self._wakeup.wait(min(remaining, self.max_slice)):
+                self._wakeup.clear()
+                reason, self._reason = self._reason, WAKEUP
+                if reason == RESUME and not self._is_new_resume():
+                    continue
+                return reason
+
+            mono_elapsed = time.monotonic() - mono_start
+            # The monotonic clock stops while suspended, so if it fell behind we slept through a suspend. Without
+            # logind telling us this is only noticed once the slice is over
+            if _boottime() - boot_start - mono_elapsed > self.jump_tolerance:
+                if self._is_new_resume():
+                    return RESUME
+            elif abs(time.time() - wall_start - mono_elapsed) > self.jump_tolerance:
+                return CLOCK_JUMP
+
+
+#   Wake the timer up as soon as the system resumes from suspend, returns False if logind can't be reached
+def watch_sleep(timer):
+    try:
+        from gi.repository import Gio, GLib
+    except ImportError:
+        return False
+
+    try:
+        bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+    except GLib.Error:
+        return False
+
+    # noinspection PyUnusedLocal
+    def on_prepare_for_sleep(connection, sender, path, interface, signal, parameters):
+        # Emitted with True right before suspending and with False right after resuming
+        if not parameters.unpack()[0]:
+            timer.wake(RESUME)
+
+    bus.signal_subscribe('org.freedesktop.login1', 'org.freedesktop.login1.Manager', 'PrepareForSleep',
+                         '/org/freedesktop/login1', None, Gio.DBusSignalFlags.NONE, on_prepare_for_sleep)
+    threading.Thread(target=GLib.MainLoop().run, daemon=True).start()
+    return True
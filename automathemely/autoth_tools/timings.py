@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from automathemely.autoth_tools.utils import get_local, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Every switch is appended as a line to this one, it's rotated (keeping a single old file) once it gets this big
+METRICS_FILE = 'metrics.jsonl'
+METRICS_MAX_BYTES = 1024 * 1024
+# Only the last switch, for node_exporter's textfile collector (point its --collector.textfile.directory here)
+PROMETHEUS_FILE = 'metrics.prom'
+
+
+#   The timing spans of a single switch, spans may be added from any thread
+class Trace:
+    def __init__(self):
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, name, start, duration, ok, labels):
+        with self.lock:
+            self.spans.append({'name': name, 'labels': labels, 'start': start - self.start, 'duration': duration,
+                               'ok': ok})
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.add(name, start, time.perf_counter() - start, ok, labels)
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def to_record(self, mode=None):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s['start'])
+        return {'timestamp': self.timestamp, 'mode': mode, 'total': self.total(), 'spans': spans}
+
+
+_trace = Trace()
+
+
+#   Start timing a new switch, spans from then on go to the returned trace
+def begin():
+    global _trace
+    _trace = Trace()
+    return _trace
+
+
+def current():
+    return _trace
+
+
+#   Time the block into the current trace. Work handed to other threads that may outlive it should hold on to
+#   current() and use its span() instead
+def span(name, **labels):
+    return _trace.span(name, **labels)
+
+
+def _format_labels(labels):
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for k, v in sorted(labels.items()))
+
+
+def to_prometheus(record):
+    # The same span may happen more than once (e.g. the same backend for two themes), add them up
+    durations = dict()
+    for s in record['spans']:
+        key = (s['name'], _format_labels(s['labels']))
+        durations[key] = durations.get(key, 0) + s['duration']
+
+    lines = ['# HELP automathemely_span_duration_seconds How long each phase of the last theme switch took',
+             '# TYPE automathemely_span_duration_seconds gauge']
+    for (name, labels), duration in sorted(durations.items()):
+        lines.append('automathemely_span_duration_seconds{{{}}} {:.6f}'.format(
+            _format_labels({'span': name}) + (',' + labels if labels else ''), duration))
+
+    lines += ['# HELP automathemely_switch_duration_seconds How long the last theme switch took',
+              '# TYPE automathemely_switch_duration_seconds gauge',
+              'automathemely_switch_duration_seconds {:.6f}'.format(record['total']),
+              '# HELP automathemely_switch_timestamp_seconds When the last theme switch happened',
+              '# TYPE automathemely_switch_timestamp_seconds gauge',
+              'automathemely_switch_timestamp_seconds {:.3f}'.format(record['timestamp'])]
+    return '\n'.join(lines) + '\n'
+
+
+#   Write the trace to the metrics files, returns its record
+def export(trace=None, mode=None):
+    record = (trace or _trace).to_record(mode)
+
+    metrics_path = get_local(METRICS_FILE)
+    try:
+        if os.path.getsize(metrics_path) > METRICS_MAX_BYTES:
+            os.replace(metrics_path, metrics_path + '.1')
+    except OSError:
+        pass
+
+    try:
+        with open(metrics_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        atomic_write(get_local(PROMETHEUS_FILE), to_prometheus(record))
+    except OSError as e:
+        logger.warning('Could not write the switch metrics ({})'.format(e))
+
+    return record
+
+
+def format_breakdown(record):
+    rows = []
+    for s in record['spans']:
+        label = s['name']
+        if s['labels']:
+            label += ' ({})'.format(', '.join(str(v) for _, v in sorted(s['labels'].items())))
+        if not s['ok']:
+            label += ' [failed]'
+        rows.append((label, s['duration']))
+    rows.append(('total', record['total']))
+
+    width = max(len(label) for label, _ in rows)
+    return '\n'.join('{:<{}}  {:>9.1f} ms'.format(label, width, duration * 1000) for label, duration in rows)
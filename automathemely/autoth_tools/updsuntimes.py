@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 import logging
-from datetime import timedelta
-from datetime import date
+from datetime import date, datetime, time, timedelta
+from math import isnan
 from time import sleep
 
 import pytz
 import tzlocal
 from astral import LocationInfo
-from astral.sun import sun
+from astral.sun import sunrise, sunset
 
 from automathemely.autoth_tools.utils import get_local, verify_desktop_session
 
@@ -36,7 +36,7 @@ def get_loc_from_ip():
     return
 
 
-def main(us_se):
+def get_location(us_se):
     if 'location' not in us_se:
         logger.error('Invalid config file')
         return
@@ -74,24 +74,68 @@ def main(us_se):
     except ValueError as e:
         logger.error(str(e))
         return
-	
-    s = sun(location.observer, date=date.today(), tzinfo=pytz.timezone(location.timezone))
-    sunrise = s['sunrise'].replace(second=0) + timedelta(minutes=us_se['offset']['sunrise'])
-    sunset = s['sunset'].replace(second=0) + timedelta(minutes=us_se['offset']['sunset'])
 
-    #   Convert to UTC for storage
-    return sunrise.astimezone(pytz.utc), sunset.astimezone(pytz.utc)
+    return location
 
 
-#   This should only be called when running through systemd
+def _astral_sun_times(location, day, tz):
+    # sun() would also give up on days without twilight (e.g. white nights), which we don't care about
+    try:
+        return (sunrise(location.observer, date=day, tzinfo=tz).timestamp(),
+                sunset(location.observer, date=day, tzinfo=tz).timestamp())
+    except ValueError:
+        return None, None
+
+
+#   Returns a list of (date, sunrise, sunset) for as many days as requested starting today
+def main(us_se, days=1):
+    location = get_location(us_se)
+    if not location:
+        return
+
+    tz = pytz.timezone(location.timezone)
+    first_day = date.today()
+    days = [first_day + timedelta(days=i) for i in range(days)]
+
+    try:
+        from automathemely.autoth_tools import solarcalc
+    except ImportError:
+        solarcalc = None
+
+    if solarcalc:
+        # All days at once, in UTC epoch seconds
+        offsets = [tz.utcoffset(datetime.combine(day, time(12))).total_seconds() for day in days]
+        times = solarcalc.sun_times(days, location.latitude, location.longitude, [offsets],
+                                    events=('sunrise', 'sunset'))
+        sun_times = zip(times['sunrise'][0], times['sunset'][0])
+    else:
+        sun_times = (_astral_sun_times(location, day, tz) for day in days)
+
+    entries = []
+    for day, (rise, set_) in zip(days, sun_times):
+        if rise is None or set_ is None or isnan(rise) or isnan(set_):
+            # The sun never rises or never sets on this day (polar day/night), it'll just have to stay as it is
+            continue
+
+        # Drop the seconds just like before, then apply the offsets
+        rise = datetime.fromtimestamp(rise // 60 * 60, pytz.utc) + timedelta(minutes=us_se['offset']['sunrise'])
+        set_ = datetime.fromtimestamp(set_ // 60 * 60, pytz.utc) + timedelta(minutes=us_se['offset']['sunset'])
+
+        #   Already in UTC for storage
+        entries.append((day, rise, set_))
+
+    return entries
+
+
+#   Rebuild the transition table on its own, normally this is done on demand by whoever needs it
 if __name__ == '__main__':
     import json
-    import pickle as pkl
     import logging
 
     # When importing automathemely we inherit the root logger, so we need to configure it for our purposes
     from automathemely import main_file_handler, notifier_handler, updsun_file_handler, \
         default_simple_format, timed_details_format
+    from automathemely.autoth_tools import suntable
 
     # I know there also is logging.root, but I found it has some weird behaviours
     root_logger = logging.getLogger()
@@ -116,11 +160,7 @@ if __name__ == '__main__':
     with open(get_local('user_settings.json'), 'r') as f:
         user_settings = json.load(f)
 
-    output = main(user_settings)
-    if output:
-        with open(get_local('sun_times'), 'wb') as file:
-            pkl.dump(output, file, protocol=pkl.HIGHEST_PROTOCOL)
-    else:
+    if not suntable.update(user_settings):
         if verify_desktop_session():
             run_as_main_logger.warning('There were some errors while updating the sunrise and sunset times, check {} '
                                        'for more details'.format(get_local('.updsuntimes.log')))
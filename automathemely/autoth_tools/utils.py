@@ -22,6 +22,33 @@ def get_root(path=''):
     return str(Path(_ROOT).joinpath(path))
 
 
+#   Write to a temporary file next to path and rename it over, so readers only ever see the old or the new contents
+def atomic_write(path, data):
+    import os
+    import tempfile
+
+    path = str(path)
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(name), suffix='.tmp', dir=directory or '.')
+    try:
+        with (os.fdopen(fd, 'wb') if isinstance(data, bytes) else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # Keep the permissions of the file being replaced
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
 #   DICT RELATED FUNCTIONS
 def read_dict(dic, keys):
     for k in keys:
@@ -47,26 +74,79 @@ def update_dict(d, u):
     return d
 
 
+# Pre and post release tags, ordered as in PEP 440 (1.3.dev1 < 1.3a1 < 1.3b1 < 1.3rc1 < 1.3 < 1.3.post1)
+VERSION_PHASES = {'dev': 0, 'a': 1, 'alpha': 1, 'b': 2, 'beta': 2, 'c': 3, 'rc': 3, 'pre': 3, 'preview': 3, 'post': 5}
+FINAL_PHASE = 4
+
+
+#   Sortable key for our own version strings (e.g. 1.3.0-dev1) that orders them like pkg_resources did, without having
+#   to import it: trailing zeros don't matter (1.2 == 1.2.0) and pre-releases come before their release
+def parse_version(version):
+    import re
+
+    match = re.match(r'(\d+(?:\.\d+)*)(?:[-_.]?([a-z]+)[-_.]?(\d*))?', str(version).strip().lower())
+    if not match:
+        return (), FINAL_PHASE, 0
+
+    numbers = [int(part) for part in match.group(1).split('.')]
+    while len(numbers) > 1 and numbers[-1] == 0:
+        numbers.pop()
+
+    # Unknown tags are treated as the release itself
+    phase = VERSION_PHASES.get(match.group(2), FINAL_PHASE)
+    return tuple(numbers), phase, int(match.group(3) or 0)
+
+
 #   MISC FUNCTIONS
+#   Show a notification right away, see notifier for the coalesced and rate limited ones logging uses
 def notify(message, title='AutomaThemely'):
-    import gi
-    gi.require_version('Notify', '0.7')
-    from gi.repository import Notify, GLib
+    from automathemely.autoth_tools.notifier import get_notifier
+    get_notifier().show(message, title)
 
-    if not Notify.is_initted():
-        Notify.init('AutomaThemely')
 
-    n = Notify.Notification.new(title, message, get_resource('automathemely.svg'))
-    try:  # I don't even know... https://bugzilla.redhat.com/show_bug.cgi?id=1582833
-        n.show()
-    except GLib.GError as e:
-        if str(e) != 'g-dbus-error-quark: Unexpected reply type (16)' \
-                and str(e) != 'g-dbus-error-quark: GDBus.Error:org.freedesktop.DBus.Error.NoReply: Message recipient ' \
-                              'disconnected from message bus without replying (4)':
-            raise e
+# Processes whose presence means a supported desktop session is up
+# noinspection SpellCheckingInspection
+SESSION_PROCESSES = ('gnome-session', 'plasmashell', 'cinnamon-session', 'xfce4-session')
 
 
+#   Single pass over /proc instead of forking a pgrep for every name
 def pgrep(process_names, use_full=False):
+    import os
+    try:
+        entries = os.scandir('/proc')
+    except FileNotFoundError:
+        return _pgrep_subprocess(process_names, use_full)
+
+    # Just like pgrep, names are matched against the first 15 characters of the process name, which is all the kernel
+    # keeps, or against the whole command line
+    if use_full:
+        patterns = [p_name.encode('utf-8') for p_name in process_names]
+    else:
+        patterns = [p_name[:15] for p_name in process_names]
+    own_pid = str(os.getpid())
+
+    with entries:
+        for entry in entries:
+            if not entry.name.isdigit() or entry.name == own_pid:
+                continue
+            try:
+                if use_full:
+                    with open('/proc/{}/cmdline'.format(entry.name), 'rb') as f:
+                        p_info = f.read().replace(b'\0', b' ')
+                else:
+                    with open('/proc/{}/comm'.format(entry.name)) as f:
+                        p_info = f.read().rstrip('\n')
+            # Processes can go away while we look at them
+            except OSError:
+                continue
+
+            if any(pattern in p_info for pattern in patterns):
+                return True
+
+    return False
+
+
+def _pgrep_subprocess(process_names, use_full=False):
     from subprocess import run, DEVNULL
     command = ['pgrep']
     if use_full:
@@ -78,15 +158,13 @@ def pgrep(process_names, use_full=False):
             return True
 
 
-def verify_desktop_session(wait=False):
+#   If wait is set, block until the session is up or timeout (in seconds, None for no limit) runs out
+def verify_desktop_session(wait=False, timeout=None, interval=1):
     import time
+    deadline = None if timeout is None else time.monotonic() + timeout
     while True:
-        # noinspection SpellCheckingInspection
-        if pgrep(['gnome-session', 'plasmashell', 'cinnamon-session', 'xfce4-session']):
-            if not wait:
-                return True
-            break
-        else:
-            if not wait:
-                return False
-            time.sleep(1)
+        if pgrep(SESSION_PROCESSES):
+            return True
+        elif not wait or (deadline is not None and time.monotonic() >= deadline):
+            return False
+        time.sleep(interval)
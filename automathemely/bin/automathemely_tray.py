@@ -3,6 +3,13 @@
 import os, sys, shutil, subprocess
 from PyQt5 import QtWidgets, QtGui, QtCore
 
+try:
+    from automathemely.autoth_tools.ctlsocket import send_command
+except ImportError:
+    # without the package everything goes through the wrapper
+    def send_command(command, timeout=None, **params):
+        return None
+
 LOG_PATH = os.path.expanduser("~/.config/automathemely/.autothscheduler.log")
 # fallback python launcher (edit if you want)
 VENV_PY = os.path.expanduser("~/Pysolated/penv_automathemely12v2/bin/python")
@@ -53,6 +60,10 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
         self.act_open = self.menu.addAction("Open Manager")
         self.act_restart = self.menu.addAction("Restart Scheduler")
         self.menu.addSeparator()
+        self.act_light = self.menu.addAction("Light")
+        self.act_dark = self.menu.addAction("Dark")
+        self.act_auto = self.menu.addAction("Automatic")
+        self.menu.addSeparator()
         self.act_show = self.menu.addAction("Show last log")
         self.menu.addSeparator()
         self.act_quit = self.menu.addAction("Quit")
@@ -60,6 +71,9 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
 
         self.act_open.triggered.connect(self.open_manager)
         self.act_restart.triggered.connect(self.restart_scheduler)
+        self.act_light.triggered.connect(lambda: self.apply_mode("light"))
+        self.act_dark.triggered.connect(lambda: self.apply_mode("dark"))
+        self.act_auto.triggered.connect(lambda: self.apply_mode("auto"))
         self.act_show.triggered.connect(self.show_last_log)
         self.act_quit.triggered.connect(QtWidgets.qApp.quit)
 
@@ -86,11 +100,25 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
         self.run_cmd(cmd)
 
     def restart_scheduler(self):
+        # a running scheduler only needs to reload, that's instant
+        resp = send_command("reload", timeout=2)
+        if resp and resp.get("ok"):
+            self.showMessage("AutomaThemely", "Scheduler reloaded")
+            return
         base = find_wrapper()
         cmd = base + ["--restart"] if len(base) == 1 else base + ["--restart"]
         self.run_cmd(cmd)
         self.showMessage("AutomaThemely", "Restart requested")
 
+    def apply_mode(self, mode):
+        resp = send_command("apply", mode=mode)
+        if resp is None:
+            # no scheduler listening, fall back to a one-off run
+            flags = {"light": ["--light"], "dark": ["--dark"], "auto": []}
+            self.run_cmd(find_wrapper() + flags[mode])
+        elif not resp.get("ok"):
+            self.showMessage("AutomaThemely", "Switch failed: {}".format(resp.get("error")))
+
     def show_last_log(self):
         s = last_log_line(LOG_PATH)
         QtWidgets.QMessageBox.information(None, "Last log line", s)
@@ -98,6 +126,9 @@ class TrayApp(QtWidgets.QSystemTrayIcon):
     def update_last_line(self):
         s = last_log_line(LOG_PATH)
         tooltip = (s[:200] + "...") if len(s) > 200 else s
+        status = send_command("status", timeout=1)
+        if status and status.get("ok") and status.get("next_run"):
+            tooltip = "Next: {} at {}\n{}".format(status["next_mode"], status["next_run"][11:16], tooltip)
         self.setToolTip(tooltip)
         self.last_line_action.setText("Last: " + (s[:80] + "..." if len(s) > 80 else s))
 
@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 import sys
-import shutil
 import logging
-import time
 from datetime import datetime
-
-from schedule import Scheduler, CancelJob
+from threading import Lock, Thread
 
 from automathemely import info_or_lower_handler, warning_or_higher_handler, scheduler_file_handler, timed_details_format
+from automathemely.autoth_tools import timekeeper
 from automathemely.autoth_tools.utils import get_local
 
 logger = logging.getLogger('autothscheduler.py')
@@ -20,91 +18,231 @@ logger.addHandler(warning_or_higher_handler)
 for handler in logger.handlers[:]:
     handler.setFormatter(logging.Formatter(timed_details_format))
 
+# How long a scheduled run waits for a desktop session to be up before giving up on it
+SESSION_TIMEOUT = 10 * 60
 
-def get_next_run():
-    import pickle, tzlocal, pytz
-    try:
-        with open(get_local('sun_times'), 'rb') as file:
-            sunrise, sunset = pickle.load(file)
-    except FileNotFoundError:
-        import sys
-        logger.error('Could not find times file, exiting...')
+
+def get_next_run(daemon):
+    from automathemely.autoth_tools import suntable
+
+    table = suntable.load()
+    if not suntable.is_valid(table, daemon.user_settings):
+        if suntable.is_usable(table, daemon.user_settings):
+            # There are still transitions to schedule, so don't hold up the loop (and its control socket) on the
+            # location lookup, rebuild in the background and reschedule once it's done
+            daemon.refresh_table()
+        else:
+            # Nothing to schedule from until it's rebuilt
+            table = suntable.update(daemon.user_settings)
+
+    transition = suntable.next_transition(table) if table else None
+    if not transition:
+        logger.error('Could not get the sunrise and sunset times, exiting...')
         sys.exit()
 
-    try:
-        local_tz = tzlocal.get_localzone()
-    except Exception as e:
-        logger.warning('tzlocal failed (%s), falling back to system local timezone', e)
-        local_tz = datetime.now().astimezone().tzinfo
+    return datetime.fromtimestamp(transition[0]).astimezone(), transition[1]
+
+
+#   Export a switch's timings once its scripts are done too, without holding anything up until then
+def export_timings(trace, t_color, scripts_thread=None):
+    from automathemely.autoth_tools import timings
+
+    if scripts_thread is None:
+        timings.export(trace, t_color)
+        return
+
+    def _export():
+        scripts_thread.join()
+        timings.export(trace, t_color)
+
+    Thread(target=_export, name='timings', daemon=True).start()
 
-    now = datetime.now(pytz.utc).astimezone(local_tz).time()
-    sunrise, sunset = (sunrise.astimezone(local_tz).time(),
-                       sunset.astimezone(local_tz).time())
 
-    if sunrise < now < sunset:
-        return ':'.join(str(sunset).split(':')[:-1])
-    else:
-        return ':'.join(str(sunrise).split(':')[:-1])
+class SwitchDaemon:
+    # Keeps the settings and everything imported by the apply pipeline (GSettings handles, desktop environment
+    # backends...) in memory, so a transition doesn't have to pay for a whole new interpreter
+    def __init__(self):
+        self.lock = Lock()
+        self.timer = timekeeper.DeadlineTimer()
+        self.running = True
+        self.user_settings = None
+        self.settings_mtime = None
+        self.current_mode = None
+        self.next_run = None
+        self.refreshing_table = False
+        self.reload_settings()
 
+    def reload_settings(self, force=False):
+        import os
+        from automathemely import notifier_handler, default_simple_format
+        from automathemely.autoth_tools import switcher
 
-def run_automathemely():
+        # A single stat is enough to know whether the settings changed since the last run
+        try:
+            mtime = os.stat(get_local('user_settings.json')).st_mtime_ns
+        except FileNotFoundError:
+            # Gone (or never there), load_user_settings creates it again from the defaults
+            mtime = None
+        if not force and mtime is not None and mtime == self.settings_mtime:
+            return
+
+        self.user_settings, _ = switcher.load_user_settings()
+        self.settings_mtime = os.stat(get_local('user_settings.json')).st_mtime_ns if mtime is None else mtime
+
+        root_logger = logging.getLogger()
+        if self.user_settings['misc']['notifications']:
+            notifier_handler.setFormatter(logging.Formatter(default_simple_format))
+            root_logger.addHandler(notifier_handler)
+        else:
+            root_logger.removeHandler(notifier_handler)
+
+    #   Rebuild the sun times table without blocking, if it fails it's tried again the next time the loop comes around
+    def refresh_table(self):
+        from automathemely.autoth_tools import suntable
+
+        if self.refreshing_table:
+            return
+        self.refreshing_table = True
+        user_settings = self.user_settings
+
+        def _refresh():
+            try:
+                if suntable.update(user_settings):
+                    self.timer.wake()
+                else:
+                    logger.warning('Could not update the sunrise and sunset times, using the old ones for now')
+            except Exception as e:
+                logger.exception('Error while updating the sunrise and sunset times', exc_info=e)
+            finally:
+                self.refreshing_table = False
+
+        Thread(target=_refresh, daemon=True).start()
+
+    def apply(self, t_color='auto'):
+        from automathemely.autoth_tools import profiling, switcher, timings
+
+        # Scheduled runs, clock jumps and such may overlap, but switching must not
+        with self.lock:
+            trace = timings.begin()
+            with timings.span('load_settings'):
+                self.reload_settings()
+            # Same as --profile, set with misc.profile (cpu or alloc)
+            with profiling.profiled(self.user_settings['misc'].get('profile'), 'scheduler-apply'):
+                if t_color == 'auto':
+                    sun_times = switcher.load_sun_times(self.user_settings)
+                    if not sun_times:
+                        logger.error('Could not get the sunrise and sunset times')
+                        return
+                    t_color = switcher.get_auto_mode(*sun_times)
+                scripts_thread = switcher.apply_mode(self.user_settings, t_color)
+            export_timings(trace, t_color, scripts_thread)
+            self.current_mode = t_color
+            return t_color
+
+    #   CONTROL SOCKET COMMANDS
+    def get_control_handlers(self):
+        return {
+            'apply': self.on_apply,
+            'reload': self.on_reload,
+            'status': self.on_status,
+            'shutdown': self.on_shutdown
+        }
+
+    def on_apply(self, mode='auto'):
+        if mode not in ('auto', 'light', 'dark'):
+            raise ValueError('Invalid mode "{}"'.format(mode))
+        logger.info('Applying {} mode as requested...'.format(mode))
+        return {'mode': self.apply(mode)}
+
+    def on_reload(self):
+        with self.lock:
+            self.reload_settings(force=True)
+        # Location or offsets may have changed, so the next run too
+        self.timer.wake()
+
+    def on_status(self):
+        import os
+        status = {'pid': os.getpid(), 'mode': self.current_mode, 'next_run': None, 'next_mode': None}
+        if self.next_run:
+            status['next_run'] = self.next_run[0].isoformat()
+            status['next_mode'] = self.next_run[1]
+        return status
+
+    def on_shutdown(self):
+        logger.info('Shutdown requested')
+        self.running = False
+        self.timer.wake()
+
+
+def run_automathemely(daemon):
     # run the blocking/waiting task in a daemon thread so the scheduler loop
     # stays responsive (verify_desktop_session(True) blocks).
-    from threading import Thread
-
     def _task():
         from automathemely.autoth_tools.utils import verify_desktop_session
-        from subprocess import check_output, PIPE
-        import shutil
-        import sys
         try:
-            verify_desktop_session(True)
-
-            # prefer an installed wrapper/launcher if available
-            wrapper = shutil.which("automathemely")
-            if wrapper:
-                cmd = [wrapper]
-            else:
-                # fallback to the current interpreter running this process
-                py = sys.executable or "python3"
-                cmd = [py, "-m", "automathemely"]
-
-            check_output(cmd, stderr=PIPE)
+            if not verify_desktop_session(True, timeout=SESSION_TIMEOUT):
+                logger.warning('No desktop session showed up, skipping this run')
+                return
+            daemon.apply()
         except Exception as e:
             logger.exception("Scheduled run failed: %s", e)
 
     Thread(target=_task, daemon=True).start()
-    # The scheduler expects the job to cancel itself after running once
-    return CancelJob
-
 
-    Thread(target=_task, daemon=True).start()
-    # job should cancel itself after launch
-    return CancelJob
 
-class SafeScheduler(Scheduler):
-    def __init__(self, reschedule_on_failure=False):
-        self.reschedule_on_failure = reschedule_on_failure
-        super().__init__()
+def main():
+    from automathemely import main_file_handler
+    from automathemely.autoth_tools.ctlsocket import ControlServer
 
-    def _run_job(self, job):
-        # noinspection PyBroadException
-        try:
-            super()._run_job(job)
-        except Exception as e:
-            logger.exception('Exception while running AutomaThemely', exc_info=e)
-            job.last_run = datetime.now()
-            # job._schedule_next_run()
+    # Everything applied in-process logs through the root logger, which should go to our log instead of the one
+    # belonging to the CLI
+    root_logger = logging.getLogger()
+    root_logger.removeHandler(main_file_handler)
+    root_logger.addHandler(scheduler_file_handler)
 
+    daemon = SwitchDaemon()
+    timer = daemon.timer
+    if not timekeeper.watch_sleep(timer):
+        logger.warning('Could not connect to logind, resuming from suspend may take a few minutes to be noticed')
 
-scheduler = SafeScheduler()
+    # Lets the CLI, tray and settings manager talk to this process instead of starting new ones
+    control_server = ControlServer(daemon.get_control_handlers())
+    try:
+        control_server.start()
+    except (OSError, RuntimeError) as e:
+        logger.error('Could not open the control socket ({}), exiting...'.format(e))
+        sys.exit()
 
-while True:
-    scheduler.every().day.at(get_next_run()).do(run_automathemely)
+    try:
+        while daemon.running:
+            with daemon.lock:
+                daemon.reload_settings()
+            daemon.next_run = get_next_run(daemon)
+            next_run = daemon.next_run[0]
+            logger.info('Next run scheduled for {}'.format(next_run.strftime('%Y-%m-%d %H:%M')))
+
+            # Sleeps until the deadline instead of polling every second
+            reason = timer.wait_until(next_run.timestamp())
+
+            if reason == timekeeper.WAKEUP:
+                continue
+            elif reason == timekeeper.CLOCK_JUMP:
+                # We may have been moved across a transition in either direction, so just apply whatever is right
+                # for the new time and reschedule from there
+                logger.warning('System clock changed, rescheduling...')
+            elif reason == timekeeper.RESUME:
+                # However many transitions were missed while asleep, only the current one matters
+                logger.info('Resumed from suspend, catching up...')
 
-    while True:
-        if not scheduler.jobs:
             logger.info('Running...')
-            break
-        scheduler.run_pending()
-        time.sleep(1)
+            # noinspection PyBroadException
+            try:
+                run_automathemely(daemon)
+            except Exception as e:
+                logger.exception('Exception while running AutomaThemely', exc_info=e)
+    finally:
+        control_server.stop()
+
+
+if __name__ == '__main__':
+    main()
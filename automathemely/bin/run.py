@@ -1,15 +1,9 @@
 #!/usr/bin/env python3
-import json
+import atexit
 import logging
-import pickle as pkl
-import shutil
 import sys
-from datetime import datetime
 from os import chdir, getuid
 from pathlib import Path
-import subprocess, sys
-import pytz
-import tzlocal
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +13,17 @@ def check_root():  # Prevent from being run as root for security and compatibili
         logger.critical('This shouldn\'t be run as root unless told otherwise!')
         sys.exit()
 
+
+def finish_timings(t_color, print_breakdown):
+    from automathemely.autoth_tools import timings
+    from automathemely.autoth_tools.logqueue import pipeline
+
+    record = timings.export(mode=t_color)
+    if print_breakdown:
+        pipeline.drain()
+        print(timings.format_breakdown(record))
+
+
 def main():
 
     check_root()
@@ -29,56 +34,30 @@ def main():
     if repo_root not in sys.path:
         sys.path.insert(0, repo_root)
     
-    import automathemely
+    from automathemely.autoth_tools import argmanager, profiling, timings
 
-    from automathemely.autoth_tools import argmanager, extratools, envspecific, updsuntimes
+    timings.begin()
+    args = argmanager.parser.parse_args()
+    # If the scheduler is running let it do the switching, it already has everything loaded
+    if argmanager.send_to_scheduler(args):
+        return
+
+    with profiling.profiled(args.profile, argmanager.get_command(args)):
+        switch(args)
 
-    from automathemely import __version__ as version
-    from automathemely.autoth_tools.utils import get_resource, get_local, update_dict
+
+def switch(args):
+    import automathemely
+    from automathemely.autoth_tools import argmanager, switcher
+    from automathemely.autoth_tools.timings import span
 
     #   Set workspace as the directory of the script
     workspace = Path(__file__).resolve().parent
     chdir(str(workspace))
     sys.path.append('..')
 
-    first_time_run = False
-
-    #   Test for settings file and if it doesn't exist copy it from defaults
-    if not Path(get_local('user_settings.json')).is_file():
-        shutil.copy2(get_resource('default_user_settings.json'), get_local('user_settings.json'))
-        # By default notifications are enabled
-        from automathemely import notifier_handler
-        logging.getLogger().addHandler(notifier_handler)
-        logger.info('No valid config file found, creating one...')
-        first_time_run = True
-
-    try:
-        with open(get_local('user_settings.json'), 'r') as f:
-            user_settings = json.load(f)
-    except json.decoder.JSONDecodeError:
-        user_settings = dict()
-
-    #   If settings files versions don't match (in case of an update for instance), overwrite values of
-    #   default_settings with user_settings and use that instead
-
-    logger.debug('Program version = {}'.format(version))
-    logger.debug('File version = {}'.format(str(user_settings['version'])))
-    if 'version' not in user_settings or str(user_settings['version']) != version:
-        with open(get_resource('default_user_settings.json'), 'r') as f:
-            default_settings = json.load(f)
-
-        from pkg_resources import parse_version
-
-        # Hardcoded attempt to try to import old structure to new structure...
-        if parse_version(str(user_settings['version'])) <= parse_version('1.2'):
-            logger.debug('Lower version!')
-            user_settings['themes']['gnome'] = dict()
-            user_settings['themes']['gnome']['light'], user_settings['themes']['gnome']['dark'] = dict(), dict()
-            user_settings['themes']['gnome']['light']['gtk'] = user_settings['themes'].pop('light', '')
-            user_settings['themes']['gnome']['dark']['gtk'] = user_settings['themes'].pop('dark', '')
-
-        user_settings = update_dict(default_settings, user_settings)
-        user_settings['version'] = version
+    with span('load_settings'):
+        user_settings, first_time_run = switcher.load_user_settings()
 
     if user_settings['misc']['notifications']:
         # Not exactly sure why this is needed but alright...
@@ -88,8 +67,8 @@ def main():
 
     theme = 'auto'
     #   If any argument is given, pass it/them to the arg manager module
-    if len(sys.argv) > 1:
-        mode = automathemely.autoth_tools.argmanager.main(user_settings)
+    if argmanager.get_command(args) != 'auto':
+        mode = argmanager.main(user_settings, args)
         # check if manual theme mode returned
         if mode is None:
             # auto theme mode; continue
@@ -102,53 +81,19 @@ def main():
     if first_time_run:
         return
 
-    if not Path(get_local('sun_times')).is_file():
-        logger.info('No valid times file found, creating one...')
-        output = updsuntimes.main(user_settings)
-        if output:
-            with open(get_local('sun_times'), 'wb') as file:
-                pkl.dump(output, file, protocol=pkl.HIGHEST_PROTOCOL)
-
-    # https://github.com/regebro/tzlocal/issues/74
-    # local_tz = tzlocal.get_localzone()
-    # from datetime import timezone, timedelta
-    # local_tz = timezone(timedelta(seconds=10800), 'EEST')
-    local_tz = datetime.now().astimezone().tzinfo
-
-    with open(get_local('sun_times'), 'rb') as file:
-        sunrise, sunset = pkl.load(file)
-
-    #   Convert to local timezone and ignore date
-    now = datetime.now(pytz.utc).astimezone(local_tz).time()
-    sunrise, sunset = sunrise.astimezone(local_tz).time(), sunset.astimezone(local_tz).time()
-
     if theme == 'auto':
-        if sunrise < now < sunset:
-            t_color = 'light'
-        else:
-            t_color = 'dark'
+        sun_times = switcher.load_sun_times(user_settings)
+        if not sun_times:
+            logger.error('Could not get the sunrise and sunset times, exiting...')
+            return
+        t_color = switcher.get_auto_mode(*sun_times)
     else:
         # set manual theme mode
         t_color = theme
 
-    logger.info('Switching to {} themes...'.format(t_color))
-
-    #   Change desktop environment theme
-    desk_env = user_settings['desktop_environment']
-    if desk_env != 'custom':
-        for t_type in user_settings['themes'][desk_env][t_color]:
-            theme = user_settings['themes'][desk_env][t_color][t_type]
-            envspecific.set_theme(desk_env, t_type, theme)
-
-    #   Run user scripts
-    s_time = 'sunrise' if t_color == 'light' else 'sunset'
-    extratools.run_scripts(user_settings['extras']['scripts'][s_time],
-                           notifications_enabled=user_settings['misc']['notifications'])
-
-    #   Change extra themes
-    for k, v in user_settings['extras'].items():
-        if k != 'scripts' and v['enabled']:
-            extratools.set_extra_theme(user_settings, k, t_color)
+    # Only exported once the scripts are done too, which the interpreter waits for before running atexit functions
+    atexit.register(finish_timings, t_color, args.timings)
+    switcher.apply_mode(user_settings, t_color)
 
 
 if __name__ == '__main__':